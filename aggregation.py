@@ -0,0 +1,138 @@
+"""
+Aggregation of exchanges on a compact integer key. Rather than grouping on
+every column, rows are grouped on factorized identifying columns and the
+attributes that follow from the process or flow UUID (names, regions,
+contexts, category paths) are carried through from the first row of each
+group. The result is the same as
+
+    df.groupby([c for c in df if c not in sum_cols], dropna=False)
+      .agg('sum').reset_index()
+
+including row order and dtypes, provided the carried columns are constant
+for each ProcessID and FlowUUID; pass validate=True to check this.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+# Columns that are determined by ProcessID, whose UUID is generated from the
+# process name
+PROCESS_ATTRIBUTES = ['ProcessName', 'ProcessCategory', 'US Region',
+                      'Global Region', 'Fuel', 'Ship Type', 'Subtype',
+                      'Capacity (metric tons)', 'Utilization', 'location']
+# Columns that are determined by FlowUUID
+FLOW_ATTRIBUTES = ['FlowName', 'name', 'Context', 'Unit', 'unit', 'FlowType']
+
+
+def _codes(values, sort=False):
+    """Integer codes of values, NaN is assigned a code of its own."""
+    return pd.factorize(values, sort=sort, use_na_sentinel=False)[0]
+
+
+def _combine(gid, codes):
+    radix = int(codes.max(initial=0)) + 1
+    return _codes(gid * radix + codes)
+
+
+def _first_positions(gid):
+    first = np.full(int(gid.max(initial=-1)) + 1, len(gid), dtype=np.int64)
+    np.minimum.at(first, gid, np.arange(len(gid)))
+    return first
+
+
+def group_ids(df, key_cols, carry_cols=(), validate=False):
+    """
+    Group id of each row of df by key_cols.
+    :param validate: bool, refine the groups by any of carry_cols that are
+        not constant within a group
+    :return: array of group ids in order of first occurrence, list of the
+        carry_cols that were added to the key
+    """
+    gid = np.zeros(len(df), dtype=np.int64)
+    size = 1
+    for c in key_cols:
+        codes = _codes(df[c])
+        radix = int(codes.max(initial=0)) + 1
+        if size * radix >= 2**62:
+            # renumber the groups so far to stay within int64
+            gid = _codes(gid)
+            size = int(gid.max(initial=0)) + 1
+        gid = gid * radix + codes
+        size *= radix
+    gid = _codes(gid)
+    added = []
+    if validate:
+        first = _first_positions(gid)
+        for c in carry_cols:
+            codes = _codes(df[c])
+            if (codes != codes[first][gid]).any():
+                gid = _combine(gid, codes)
+                first = _first_positions(gid)
+                added.append(c)
+    return gid, added
+
+
+def aggregate_exchanges(df, sum_cols,
+                        carry_cols=PROCESS_ATTRIBUTES + FLOW_ATTRIBUTES,
+                        validate=False):
+    """
+    Sum sum_cols over rows that are identical in all other columns.
+    :param df: df of exchanges
+    :param sum_cols: list of columns to sum
+    :param carry_cols: list of columns that are not grouped on, as they are
+        constant for the other columns, their first value is kept
+    :param validate: bool, group on any carry_cols that are not constant
+        rather than keeping the first value
+    :return: df with columns in the order of df (sum_cols last), sorted by
+        those columns
+    """
+    cols = [c for c in df if c not in sum_cols]
+    carry_cols = [c for c in cols if c in carry_cols]
+    gid, added = group_ids(df, [c for c in cols if c not in carry_cols],
+                           carry_cols, validate=validate)
+    if added:
+        print(f'Columns not constant within exchanges: {", ".join(added)}')
+    first = _first_positions(gid)
+    agg = df[cols].iloc[first].reset_index(drop=True)
+    for c in agg.columns[agg.dtypes == object]:
+        # infer the dtype as groupby does for the key levels
+        agg[c] = pd.Index(agg[c].to_numpy()).infer_objects()
+    for c in [c for c in df if c in sum_cols]:
+        agg[c] = df[c].groupby(gid).sum().to_numpy()
+    # Order rows as groupby(sort=True) orders its keys
+    order = np.lexsort([_codes(agg[c], sort=True) for c in reversed(cols)])
+    return agg.iloc[order].reset_index(drop=True)
+
+
+def round_sig_figs(values, sig_figs):
+    """
+    Vectorized equivalent of flcac_utils.util.round_to_sig_figs, i.e.
+    round(x, sig_figs - floor(log10(|x|)) - 1) with zero left as 0.
+    Values near a rounding tie, or beyond the range where the decimal scale
+    is exact, are rounded with the built-in round for identical results.
+    """
+    x = np.asarray(values, dtype=float)
+    out = np.zeros_like(x)
+    nonzero = (x != 0) & np.isfinite(x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log = np.log10(np.abs(x))
+    digits = sig_figs - np.floor(log) - 1
+    exact = nonzero & (np.abs(digits) <= 22)
+    d = digits[exact]
+    scale = 10.0 ** np.abs(d)
+    scaled = np.where(d >= 0, x[exact] * scale, x[exact] / scale)
+    rounded = np.round(scaled)
+    out[exact] = np.where(d >= 0, rounded / scale, rounded * scale)
+    # fall back where the scaling could decide a tie, or log10 could
+    # determine the wrong number of digits
+    frac = np.abs(scaled - np.floor(scaled) - 0.5)
+    near = np.zeros_like(nonzero)
+    near[exact] = ((frac < 1e-6) |
+                   (np.abs(log[exact] - np.round(log[exact])) < 1e-9))
+    fallback = (nonzero & ~exact) | near
+    out[fallback] = [round(v, sig_figs - int(math.floor(math.log10(abs(v)))) - 1)
+                     for v in x[fallback].tolist()]
+    out[~np.isfinite(x)] = x[~np.isfinite(x)]
+    return out
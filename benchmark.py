@@ -0,0 +1,232 @@
+"""
+Benchmark of the marine pipeline on synthetic inputs. For each scale the input
+files are copied to a temporary folder with the routes (distances.csv and
+marine_runs.csv) replicated `scale` times under new US Regions, and engine
+characteristics, emission factors and speciation fractions perturbed. Every
+stage is timed end to end without the stage cache, including the JSON-LD
+write.
+
+LCA Commons API calls are served by commons_cache in offline mode: objects
+and technosphere flow mappings come from the local object cache, or else from
+the exported JSON-LD in output/marine_v1.0, so no requests are made and a
+clean checkout can be benchmarked. Results are written as JSON. The run fails
+(exit status 1) if a stage raises, and with --baseline if a stage is slower
+than the baseline run of the same scale, engine, compact setting and workers
+by more than --threshold, or the baseline has no such run or stage.
+
+    python benchmark.py --scales 1 10 100
+    python benchmark.py --baseline .cache/benchmark/<previous>.json
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import commons_cache
+import instrumentation
+import process_marine as pm
+from stage_cache import StagePipeline
+
+results_path = pm.parent_path / '.cache' / 'benchmark'
+
+SCALES = [1, 10, 100, 1000]
+
+# Stages in the order they run, followed by the JSON-LD write
+STAGES = {'frame': ['engine_power', 'leg_timing', 'emissions', 'flow_mapping',
+                    'tech_flow_mapping', 'dqi', 'aggregation', 'json_build'],
+          'tensor': ['engine_power', 'emissions', 'flow_mapping',
+                     'tech_flow_mapping', 'dqi', 'aggregation', 'json_build'],
+          }
+
+
+def _jitter(df, cols, rng, rel=0.1):
+    for c in cols:
+        df[c] = df[c] * rng.uniform(1 - rel, 1 + rel, len(df))
+    return df
+
+
+def make_synthetic_inputs(scale, out_dir, data_path=pm.data_path, seed=0):
+    """
+    Write a synthetic input folder with `scale` times the routes of
+    data_path. Routes are replicated under new US Regions ('US East Coast 2',
+    ...), as ECA status of the origin is determined by the Global Region name.
+    :return: Path to the folder
+    """
+    rng = np.random.default_rng(seed)
+    out_dir = Path(out_dir)
+    shutil.copytree(data_path, out_dir, dirs_exist_ok=True)
+
+    def replicate(df, cols=()):
+        copies = [df] + [_jitter(df.assign(**{'US Region':
+                                              df['US Region'] + f' {k + 1}'}),
+                                 cols, rng)
+                         for k in range(1, scale)]
+        return pd.concat(copies, ignore_index=True)
+
+    replicate(pd.read_csv(data_path / 'distances.csv'),
+              ['AvgOfDistance (nm)', 'DestManeuv_Distance',
+               'OrigManeuv_Distance']).to_csv(out_dir / 'distances.csv',
+                                              index=False)
+    replicate(pd.read_csv(data_path / 'marine_runs.csv')).to_csv(
+        out_dir / 'marine_runs.csv', index=False)
+
+    if scale > 1:
+        (_jitter(pd.read_csv(data_path / 'engine_characteristics.csv'),
+                 ['Installed Propulsion Power (kW)'], rng)
+         .to_csv(out_dir / 'engine_characteristics.csv', index=False))
+        ef = pd.read_csv(data_path / 'emission_factors.csv')
+        (_jitter(ef, ef.columns.drop(['Engine', 'Fuel']), rng)
+         .to_csv(out_dir / 'emission_factors.csv', index=False))
+        (_jitter(pd.read_csv(data_path / 'flow_speciation.csv'), ['Fraction'], rng)
+         .to_csv(out_dir / 'flow_speciation.csv', index=False))
+    return out_dir
+
+
+def run_scale(scale, engine='frame', workers=1, seed=0, compact=False):
+    """Time each stage at `scale`, returns a dict of results."""
+    with tempfile.TemporaryDirectory(prefix='marine_bench_') as tmp:
+        tmp = Path(tmp)
+        t0 = time.perf_counter()
+        data_path = make_synthetic_inputs(scale, tmp / 'data', seed=seed)
+        result = {'scale': scale, 'engine': engine, 'workers': workers,
+                  'compact': compact,
+                  'generate_s': time.perf_counter() - t0,
+                  'runs': len(pd.read_csv(data_path / 'marine_runs.csv')),
+                  'stages': {}, 'error': None, 'failed_stage': None}
+
+        profiler = instrumentation.enable()
+        pipeline = StagePipeline(pm.build_stages(engine, workers, compact),
+                                 data_path=data_path, cache_path=tmp / 'cache',
+                                 use_cache=False)
+        try:
+            for name in STAGES[engine]:
+                pipeline.get(name)
+            with instrumentation.stage('write'):
+                pm.write_json(pipeline.get('json_build'),
+                              out_path=tmp / 'output', incremental=True)
+        except Exception as e:
+            # later stages depend on the failed one
+            result['error'] = f'{type(e).__name__}: {e}'
+            result['failed_stage'] = profiler.stages[-1]['name']
+        finally:
+            instrumentation.profiler = None
+        for rec in profiler.stages:
+            if rec['name'] == result['failed_stage']:
+                continue
+            result['stages'][rec['name']] = {
+                k: rec[k] for k in ('wall_s', 'local_s', 'rows_out',
+                                    'mem_out_mb', 'rss_peak_delta_mb')}
+        result['total_s'] = sum(s['wall_s'] for s in result['stages'].values())
+    return result
+
+
+def _key(r):
+    return (r['scale'], r['engine'], r.get('compact', False),
+            r.get('workers', 1))
+
+
+def compare(results, baseline, threshold, min_seconds=0.1):
+    """
+    Compare results to the runs of `baseline` with the same scale, engine,
+    compact setting and workers. Fails for stages slower than the baseline by
+    more than a factor `threshold` (ignoring differences below
+    `min_seconds`), and for runs or stages without a baseline or missing
+    from the results.
+    :return: list of failure messages
+    """
+    base = {_key(r): r for r in baseline['results']}
+    failures = []
+    for r in results:
+        label = ('scale {} {} compact={} workers={}'.format(*_key(r)))
+        b = base.get(_key(r))
+        if b is None:
+            failures.append(f'{label}: no baseline run')
+            continue
+        for name in b['stages'].keys() - r['stages'].keys():
+            failures.append(f'{label} {name}: not run')
+        for name, s in r['stages'].items():
+            if name not in b['stages']:
+                failures.append(f'{label} {name}: not in the baseline')
+                continue
+            t0 = b['stages'][name]['wall_s']
+            if s['wall_s'] > t0 * threshold and s['wall_s'] - t0 > min_seconds:
+                failures.append(f"{label} {name}: {s['wall_s']:.3f} s vs "
+                                f'{t0:.3f} s')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES,
+                        help='multiples of the current number of routes')
+    parser.add_argument('--engine', choices=['frame', 'tensor'],
+                        default='frame')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compact', action='store_true',
+                        help='hold repeated string columns as categoricals')
+    parser.add_argument('--output', type=Path,
+                        help='results file (default .cache/benchmark/'
+                        'benchmark_<timestamp>.json)')
+    parser.add_argument('--baseline', type=Path,
+                        help='results file of a previous run to compare to')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='fail if a stage takes longer than threshold x '
+                        'the baseline time')
+    parser.add_argument('--min-seconds', type=float, default=0.1,
+                        help='ignore differences smaller than this')
+    args = parser.parse_args(argv)
+
+    commons_cache.OFFLINE = True
+    started = datetime.now(timezone.utc)
+    results = []
+    for scale in args.scales:
+        r = run_scale(scale, engine=args.engine, workers=args.workers,
+                      seed=args.seed, compact=args.compact)
+        results.append(r)
+        print(f"scale {scale:>5}: {r['runs']} runs, {r['total_s']:.2f} s")
+        for name, s in r['stages'].items():
+            rows = '' if s['rows_out'] is None else f"{s['rows_out']} rows"
+            print(f"  {name:<20}{s['wall_s']:>9.3f} s  {rows}")
+        if r['error']:
+            print(f"  stopped at {r['failed_stage']}: {r['error']}")
+
+    output = args.output or (results_path /
+        f"benchmark_{started.strftime('%Y%m%dT%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'started': started.isoformat(),
+                   'python': platform.python_version(),
+                   'pandas': pd.__version__,
+                   'numpy': np.__version__,
+                   'platform': platform.platform(),
+                   'results': results}, f, indent=2)
+    print(f'Results written to {output}')
+
+    failed = [r for r in results if r['error']]
+    for r in failed:
+        print(f"FAIL scale {r['scale']}: stopped at {r['failed_stage']}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.threshold,
+                               args.min_seconds)
+        for msg in failures:
+            print(f'FAIL {msg}')
+        if failures or failed:
+            return 1
+        print(f'PASS, no stage slower than {args.threshold} x baseline')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
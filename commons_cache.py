@@ -0,0 +1,161 @@
+"""
+Persistent cache and offline stand-in for objects retrieved from the LCA
+Commons API. Objects are stored as openLCA JSON keyed by (repo, type, UUID)
+and expire after `TTL`. In offline mode no requests are made; objects are
+served from the cache, or from the exported JSON-LD in `output/marine_v1.0`.
+Technosphere flow mappings missing from the cache are rebuilt from the fuel
+mapping file and the flows and providers in that export, so the pipeline runs
+on a clean checkout without network access.
+
+Offline mode is enabled by setting `OFFLINE = True` or the environment
+variable MARINE_OFFLINE=1.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+import instrumentation
+
+parent_path = Path(__file__).parent
+cache_path = parent_path / '.cache' / 'commons'
+export_path = parent_path / 'output' / 'marine_v1.0'
+
+TTL = 30 * 24 * 3600 # seconds, cached objects older than this are refreshed
+OFFLINE = os.environ.get('MARINE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+# openLCA JSON-LD folder by API object type
+EXPORT_FOLDERS = {'ACTOR': 'actors',
+                  'DQ_SYSTEM': 'dq_systems',
+                  'FLOW': 'flows',
+                  'LOCATION': 'locations',
+                  'PROCESS': 'processes',
+                  'SOURCE': 'sources',
+                  }
+
+
+class OfflineCacheMiss(KeyError):
+    """Object requested in offline mode is not available locally."""
+
+
+def _is_fresh(path, ttl):
+    return path.exists() and (ttl is None or
+                              time.time() - path.stat().st_mtime < ttl)
+
+
+def _read_object(path):
+    import olca_schema as o
+    with open(path, encoding='utf-8') as f:
+        d = json.load(f)
+    return getattr(o, d['@type']).from_dict(d)
+
+
+def _write_object(obj, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj.to_dict(), f, indent=2)
+
+
+def get_object(repo, obj_type, uuid, ttl=TTL, offline=None):
+    """
+    Cached equivalent of flcac_utils.commons_api.get_single_object.
+    :param repo: str, LCA Commons repository, e.g. 'USLCI'
+    :param obj_type: str, API object type, e.g. 'LOCATION'
+    :param uuid: str
+    :param ttl: int, max age of a cached object in seconds, None to never expire
+    :param offline: bool, defaults to the module setting
+    """
+    offline = OFFLINE if offline is None else offline
+    path = cache_path / repo / obj_type / f'{uuid}.json'
+    if _is_fresh(path, None if offline else ttl):
+        return _read_object(path)
+    if offline:
+        exported = export_path / EXPORT_FOLDERS.get(obj_type, '') / f'{uuid}.json'
+        if exported.exists():
+            return _read_object(exported)
+        raise OfflineCacheMiss(f'{repo} {obj_type} {uuid} is not cached')
+    from flcac_utils.commons_api import get_single_object
+    with instrumentation.call(f'get_single_object {obj_type}', 'api'):
+        obj = get_single_object(repo, obj_type, uuid)
+    _write_object(obj, path)
+    return obj
+
+
+def prepare_tech_flow_mappings(fuel_df, auth=True, ttl=TTL, offline=None):
+    """
+    Cached equivalent of flcac_utils.mapping.prepare_tech_flow_mappings,
+    keyed by the content of the mapping file.
+    """
+    offline = OFFLINE if offline is None else offline
+    key = hashlib.sha256(
+        (fuel_df.to_csv(index=False) + str(auth)).encode()).hexdigest()[:16]
+    path = cache_path / 'tech_flow_mappings' / f'{key}.pkl'
+    if _is_fresh(path, None if offline else ttl):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    if offline:
+        return tech_flow_mappings_from_export(fuel_df)
+    from flcac_utils.mapping import prepare_tech_flow_mappings as _prepare
+    with instrumentation.call('prepare_tech_flow_mappings', 'api'):
+        result = _prepare(fuel_df, auth=auth)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump(result, f)
+    return result
+
+
+def tech_flow_mappings_from_export(fuel_df, path=export_path):
+    """
+    Offline stand-in for prepare_tech_flow_mappings, from the exported
+    JSON-LD: the target flows are read from the exported flows by name and
+    the providers from the default providers of the exchanges of those flows
+    in the exported processes.
+    :return: dict of mapping rows by SourceFlowName, dict of target Flow
+        objects by TargetFlowName, dict of provider Refs by Provider
+    """
+    import olca_schema as o
+
+    targets = set(fuel_df['TargetFlowName'])
+    flow_objs = {}
+    for f in (path / 'flows').glob('*.json'):
+        flow = _read_object(f)
+        if flow.name in targets:
+            flow_objs[flow.name] = flow
+    provider_ids = {}
+    for f in (path / 'processes').glob('*.json'):
+        with open(f, encoding='utf-8') as fp:
+            exchanges = json.load(fp).get('exchanges', [])
+        for e in exchanges:
+            if e.get('defaultProvider') and e['flow'].get('name') in targets:
+                provider_ids[e['flow']['name']] = e['defaultProvider']['@id']
+    missing = sorted((targets - flow_objs.keys())
+                     | (targets - provider_ids.keys()))
+    if missing:
+        raise OfflineCacheMiss(
+            'Technosphere flow mappings are not cached and the export has no '
+            f'flow or provider for: {", ".join(missing)}; run once with API '
+            'access')
+    fuel_dict = fuel_df.set_index('SourceFlowName').to_dict('index')
+    provider_dict = {
+        row['Provider']: o.Ref(ref_type=o.RefType.Process,
+                               id=provider_ids[row['TargetFlowName']],
+                               name=row['Provider'])
+        for row in fuel_dict.values()}
+    return fuel_dict, flow_objs, provider_dict
+
+
+def clear(repo=None, obj_type=None, uuid=None):
+    """Invalidate cached objects, all of them if no arguments are passed."""
+    if uuid is not None:
+        (cache_path / repo / obj_type / f'{uuid}.json').unlink(missing_ok=True)
+        return
+    path = cache_path
+    for part in (repo, obj_type):
+        if part is None:
+            break
+        path = path / part
+    shutil.rmtree(path, ignore_errors=True)
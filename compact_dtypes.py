@@ -0,0 +1,83 @@
+"""
+Compact representation of the repeated string dimensions of the long format
+frames. When enabled (`--compact` or the environment variable
+MARINE_COMPACT=1) columns such as Ship Type, Zone, Leg or Pollutant are held
+as pandas Categoricals from the time the inputs are read, and are decoded back
+to strings when the openLCA objects are built.
+
+Categories are kept sorted, so that sorting and grouping order the values as
+strings would be. Frames that are merged or concatenated are categorized
+together so that their columns share categories, otherwise pandas falls back
+to strings.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+ENABLED = os.environ.get('MARINE_COMPACT', '').lower() in ('1', 'true', 'yes')
+
+DIMENSIONS = ['Ship Type', 'Subtype', 'Fuel', 'US Region', 'Global Region',
+              'Zone', 'Leg', 'Engine', 'Engine Category', 'Engine Type',
+              'Pollutant', 'Source', 'description', 'em_flag', 'Context',
+              'Unit', 'EF_Unit', 'ProcessCategory', 'FlowName', 'FlowUUID',
+              'FlowType', 'location',
+              ]
+
+
+def _categories(values):
+    return pd.Index(pd.unique(values)).dropna().sort_values()
+
+
+def categorize(*frames, cols=DIMENSIONS):
+    """
+    Convert the dimension columns of the frames to Categoricals with
+    categories shared across the frames.
+    :return: df, or list of df if more than one frame is passed
+    """
+    frames = list(frames)
+    for c in cols:
+        present = [i for i, df in enumerate(frames) if c in df]
+        if not present:
+            continue
+        values = []
+        for i in present:
+            col = frames[i][c]
+            values.append(col.cat.categories.to_series()
+                          if isinstance(col.dtype, pd.CategoricalDtype)
+                          else col)
+        dtype = pd.CategoricalDtype(_categories(pd.concat(values,
+                                                          ignore_index=True)))
+        for i in present:
+            if frames[i][c].dtype != dtype:
+                frames[i] = frames[i].assign(**{c: frames[i][c].astype(dtype)})
+    return frames[0] if len(frames) == 1 else frames
+
+
+def transform(series, func):
+    """
+    Apply a vectorized string function (taking and returning a Series) to
+    series. For a Categorical, func is applied to the categories only and the
+    result is categorical.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return func(series)
+    categories = func(series.cat.categories.to_series().reset_index(drop=True))
+    new = _categories(categories)
+    mapping = new.get_indexer(categories)
+    codes = series.cat.codes.to_numpy()
+    return pd.Series(pd.Categorical.from_codes(
+        np.where(codes < 0, -1, mapping[codes]), dtype=pd.CategoricalDtype(new)),
+        index=series.index, name=series.name)
+
+
+def decode(df, cols=None):
+    """Convert Categorical columns of df (or only cols) back to the dtype of
+    their categories."""
+    cols = [c for c in (df.columns if cols is None else cols)
+            if c in df and isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if not cols:
+        return df
+    return df.assign(**{c: df[c].astype(df[c].cat.categories.dtype)
+                        for c in cols})
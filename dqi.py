@@ -0,0 +1,63 @@
+"""
+Exchange data quality scores held as integers. Each exchange has one column
+per pedigree matrix indicator (exchange_dqi_1 ... exchange_dqi_5), with 0 for
+exchanges without a DQI entry. Scores are formatted to the openLCA
+'(a;b;c;d;e)' string only when the processes are built, once per unique
+combination of scores.
+"""
+
+import numpy as np
+import pandas as pd
+
+MAX_SCORE = 5
+
+
+def dqi_columns(n):
+    return [f'exchange_dqi_{i}' for i in range(1, n + 1)]
+
+
+def score_array(indicators, rows):
+    """
+    :param indicators: dict of indicator to dict with a 'score', as in
+        marine_inputs.yaml
+    :param rows: int
+    :return: int array of shape (rows, number of indicators)
+    """
+    scores = np.array([v['score'] for v in indicators.values()], dtype=np.int8)
+    return np.tile(scores, (rows, 1))
+
+
+def increment(scores, mask, position, by=1):
+    """Increment the score at `position` (1-based) where mask, in place,
+    clamped at MAX_SCORE."""
+    col = scores[:, position - 1]
+    col[mask] = np.minimum(col[mask] + by, MAX_SCORE)
+    return scores
+
+
+def format_scores(scores):
+    """
+    Format each row of scores as '(a;b;c;d;e)', '' for rows without an entry
+    (all zero).
+    :return: object array of strings
+    """
+    scores = np.asarray(scores)
+    unique, inverse = np.unique(scores, axis=0, return_inverse=True)
+    labels = np.array(['' if not row.any() else
+                       '(' + ';'.join(str(v) for v in row) + ')'
+                       for row in unique], dtype=object)
+    return labels[inverse.reshape(-1)]
+
+
+def format_exchange_dqi(df):
+    """Replace the exchange_dqi_n columns of df with an exchange_dqi string
+    column at the same position."""
+    cols = [c for c in df if c.startswith('exchange_dqi_')]
+    if not cols:
+        return df
+    df = df.copy()
+    loc = df.columns.get_loc(cols[0])
+    labels = format_scores(df[cols].to_numpy())
+    df = df.drop(columns=cols)
+    df.insert(loc, 'exchange_dqi', pd.Series(labels, index=df.index))
+    return df
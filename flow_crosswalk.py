@@ -0,0 +1,98 @@
+"""
+Compiled index of a FEDEFL flow mapping (crosswalk) file. The crosswalk is
+parsed once into a table keyed by (SourceFlowName, SourceFlowContext,
+SourceUnit) with the target flow, context, unit and conversion factor, and
+stored in .cache/crosswalk under the hash of the CSV and of this module, so
+that a change to the compilation also invalidates it. Flows are mapped with a
+single join on their unique (name, context, unit) tuples, following
+esupy.mapping.apply_flow_mapping with keep_unmapped_rows=True: rows without a
+target keep their values and have no UUID.
+"""
+
+import hashlib
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from stage_cache import hash_file
+
+cache_path = Path(__file__).parent / '.cache' / 'crosswalk'
+
+KEY = ['SourceFlowName', 'SourceFlowContext', 'SourceUnit']
+TARGET = ['TargetFlowName', 'TargetFlowUUID', 'TargetFlowContext',
+          'TargetUnit', 'ConversionFactor']
+
+
+def compile_index(crosswalk):
+    """
+    :param crosswalk: path to a flow mapping CSV
+    :return: df of TARGET columns indexed by KEY
+    """
+    crosswalk = Path(crosswalk)
+    key = hashlib.sha256((hash_file(crosswalk) + hash_file(__file__))
+                         .encode()).hexdigest()
+    path = cache_path / f'{crosswalk.stem}_{key[:16]}.pkl'
+    if path.exists():
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    mapping = pd.read_csv(crosswalk)
+    dups = mapping[mapping.duplicated(KEY, keep=False)]
+    if len(dups):
+        raise ValueError(f'{crosswalk.name} maps the same flow more than once:'
+                         f'\n{dups[KEY + ["TargetFlowName"]]}')
+    index = (mapping
+             .assign(ConversionFactor = lambda x: x['ConversionFactor'].fillna(1))
+             .set_index(KEY)[TARGET]
+             )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for old in cache_path.glob(f'{crosswalk.stem}_*.pkl'):
+        old.unlink()
+    with open(path, 'wb') as f:
+        pickle.dump(index, f)
+    return index
+
+
+def apply_mapping(df, index, name, context, unit, quantity, uuid):
+    """
+    Map the flows of df to their targets in index.
+    :param name, context, unit, quantity, uuid: column names in df for the
+        flowable name, context, unit, amount and target UUID (added)
+    :return: mapped df, df of unique unmapped (name, context, unit) with the
+        number of rows of each
+    """
+    codes, uniques = pd.MultiIndex.from_frame(df[[name, context, unit]]).factorize()
+    targets = index.reindex(uniques)
+    found = targets['TargetFlowName'].notna().to_numpy()
+    mapped = found[codes]
+
+    def take(col):
+        return targets[col].to_numpy()[codes]
+
+    df = df.assign(**{
+        name: np.where(mapped, take('TargetFlowName'), df[name]),
+        context: np.where(mapped, take('TargetFlowContext'), df[context]),
+        unit: np.where(mapped, take('TargetUnit'), df[unit]),
+        quantity: np.where(mapped, df[quantity] * take('ConversionFactor'),
+                           df[quantity]),
+        uuid: np.where(mapped, take('TargetFlowUUID'), np.nan),
+        })
+    unmapped = (uniques[~found].to_frame(index=False, name=[name, context, unit])
+                .assign(rows = np.bincount(codes, minlength=len(uniques))[~found])
+                )
+    return df, unmapped
+
+
+def report_unmapped(unmapped, expected=()):
+    """Print the unmapped flows, except those in `expected` (e.g. flows
+    handled as technosphere flows)."""
+    unmapped = unmapped[~unmapped.iloc[:, 0].isin(expected)]
+    if len(unmapped) == 0:
+        return
+    by_name = unmapped.groupby(unmapped.columns[0], sort=True)['rows'].sum()
+    print(f'{len(by_name)} flows ({len(unmapped)} name, context and unit '
+          'combinations) are not mapped to FEDEFL and will be dropped '
+          f'({unmapped["rows"].sum()} rows):')
+    for name, rows in by_name.items():
+        print(f'  {name}: {rows} rows')
@@ -0,0 +1,108 @@
+"""
+Incremental export of openLCA objects to an unzipped JSON-LD folder. Each
+object is serialized as it would be written to the zip archive, and only files
+whose content changed are rewritten. Files of objects that are no longer
+generated are removed. Objects can be written as they are generated
+(FolderWriter) or all at once (export_objects).
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+# JSON-LD folder by object type
+FOLDERS = {'Actor': 'actors',
+           'DQSystem': 'dq_systems',
+           'Flow': 'flows',
+           'Location': 'locations',
+           'Process': 'processes',
+           'Source': 'sources',
+           }
+
+
+def _digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def _values(objs):
+    return objs.values() if isinstance(objs, dict) else objs
+
+
+class FolderWriter:
+    """
+    Writes objects one at a time to a JSON-LD folder, only rewriting files
+    whose content changed. Objects with an id that was already written are
+    skipped. Files of objects that were not written are removed on close.
+    """
+
+    def __init__(self, out_dir, dry_run=False):
+        self.out_dir = Path(out_dir)
+        self.dry_run = dry_run
+        self.existing = {f'{folder}/{f.name}': f
+                         for folder in FOLDERS.values()
+                         if (self.out_dir / folder).is_dir()
+                         for f in (self.out_dir / folder).glob('*.json')}
+        self.written = set()
+        self.report = {'added': [], 'changed': [], 'deleted': [],
+                       'unchanged': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+
+    def write(self, obj):
+        rel = f'{FOLDERS[type(obj).__name__]}/{obj.id}.json'
+        if rel in self.written:
+            return
+        self.written.add(rel)
+        content = obj.to_json().encode('utf-8')
+        path = self.out_dir / rel
+        if rel not in self.existing:
+            self.report['added'].append(rel)
+        elif (path.stat().st_size == len(content) and
+              _digest(path.read_bytes()) == _digest(content)):
+            self.report['unchanged'] += 1
+            return
+        else:
+            self.report['changed'].append(rel)
+        if not self.dry_run:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix('.tmp')
+            tmp.write_bytes(content)
+            os.replace(tmp, path)
+
+    def close(self):
+        """Remove files of objects not written.
+        :return: report, see export_objects"""
+        for rel in sorted(self.existing.keys() - self.written):
+            self.report['deleted'].append(rel)
+            if not self.dry_run:
+                self.existing[rel].unlink()
+        for k in ('added', 'changed'):
+            self.report[k].sort()
+        return self.report
+
+
+def export_objects(objs, out_dir, dry_run=False):
+    """
+    :param objs: iterable of dicts or lists of olca_schema root entities
+    :param out_dir: path to the JSON-LD folder, e.g. output/marine_v1.0
+    :param dry_run: bool, report the differences without writing
+    :return: dict of lists of the 'added', 'changed' and 'deleted' file
+        paths relative to out_dir, and the number 'unchanged'
+    """
+    writer = FolderWriter(out_dir, dry_run=dry_run)
+    for obj in (o for group in objs for o in _values(group)):
+        writer.write(obj)
+    return writer.close()
+
+
+def print_report(report):
+    print(f"{len(report['added'])} added, {len(report['changed'])} changed, "
+          f"{len(report['deleted'])} deleted, {report['unchanged']} unchanged")
+    for k in ('added', 'changed', 'deleted'):
+        for rel in report[k]:
+            print(f'  {k}: {rel}')
@@ -0,0 +1,188 @@
+"""
+Opt-in instrumentation of the marine pipeline. When enabled (`--profile` or
+the environment variable MARINE_PROFILE=1, or MARINE_PROFILE=<report path>),
+each stage records wall time, the increase in peak RSS, input and output row
+counts and DataFrame memory usage. Calls to the LCA Commons API ('api') and to
+flcac-utils / esupy ('library') are timed separately from local compute.
+Sections of local compute can also be timed on their own ('local'); they
+remain part of the stage's local time.
+Results are written to a JSON report and summarized on the console.
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+default_report_path = (Path(__file__).parent / '.cache' / 'profile' /
+                       'marine_profile.json')
+
+profiler = None
+
+# Kinds of calls that are not local compute
+EXTERNAL_KINDS = ('api', 'library')
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, None if unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def describe(obj):
+    """Row count and memory usage (MB) of the DataFrames in obj."""
+    if isinstance(obj, pd.DataFrame):
+        frames = [obj]
+    elif isinstance(obj, dict):
+        frames = [v for v in obj.values() if isinstance(v, pd.DataFrame)]
+    elif isinstance(obj, (list, tuple)):
+        frames = [v for v in obj if isinstance(v, pd.DataFrame)]
+    else:
+        frames = []
+    if not frames:
+        return None, None
+    return (sum(len(df) for df in frames),
+            sum(df.memory_usage(deep=True).sum() for df in frames) / 1e6)
+
+
+class _StageRecord(dict):
+
+    def output(self, result):
+        self['rows_out'], self['mem_out_mb'] = describe(result)
+
+
+class _NullRecord:
+
+    def output(self, result):
+        pass
+
+
+class Profiler:
+
+    def __init__(self):
+        self.started = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self.stages = []
+        self._active = []
+
+    @contextmanager
+    def stage(self, name, inputs=(), source='computed'):
+        rows, mem = describe(list(inputs))
+        rec = _StageRecord(name=name, source=source, rows_in=rows,
+                           mem_in_mb=mem, rows_out=None, mem_out_mb=None,
+                           calls=[])
+        rss0 = _peak_rss_mb()
+        t0 = time.perf_counter()
+        self._active.append(rec)
+        try:
+            yield rec
+        finally:
+            self._active.pop()
+            rec['wall_s'] = time.perf_counter() - t0
+            rss1 = _peak_rss_mb()
+            rec['rss_peak_delta_mb'] = (None if rss0 is None else rss1 - rss0)
+            rec['local_s'] = rec['wall_s'] - sum(
+                c['wall_s'] for c in rec['calls']
+                if c['kind'] in EXTERNAL_KINDS)
+            self.stages.append(rec)
+
+    @contextmanager
+    def call(self, name, kind):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._active:
+                self._active[-1]['calls'].append(
+                    {'name': name, 'kind': kind,
+                     'wall_s': time.perf_counter() - t0})
+
+    def report(self):
+        calls = {}
+        for rec in self.stages:
+            for c in rec['calls']:
+                calls.setdefault(c['kind'], 0)
+                calls[c['kind']] += c['wall_s']
+        return {'started': self.started.isoformat(),
+                'total_s': time.perf_counter() - self._t0,
+                'peak_rss_mb': _peak_rss_mb(),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'call_s_by_kind': calls,
+                'stages': self.stages,
+                }
+
+    def write(self, path=None):
+        path = Path(path or default_report_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        report = self.report()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return path, report
+
+
+def enable():
+    global profiler
+    profiler = Profiler()
+    return profiler
+
+
+def stage(name, inputs=(), source='computed'):
+    """Context manager recording a pipeline stage, yields a record with an
+    `output(result)` method."""
+    if profiler is None:
+        return nullcontext(_NullRecord())
+    return profiler.stage(name, inputs, source)
+
+
+def call(name, kind='library'):
+    """Context manager timing a call within the active stage. `kind` is
+    'api' for network requests, 'library' for calls to flcac-utils and
+    esupy, or 'local' for sections of local compute (counted in local_s)."""
+    if profiler is None:
+        return nullcontext()
+    return profiler.call(name, kind)
+
+
+def summarize(report):
+    def fmt(v, spec):
+        return '' if v is None else format(v, spec)
+    print(f"{'stage':<20}{'source':>9}{'wall s':>9}{'local s':>9}"
+          f"{'ext s':>8}{'rows in':>10}{'rows out':>10}{'MB out':>9}"
+          f"{'dRSS MB':>9}")
+    for rec in report['stages']:
+        print(f"{rec['name']:<20}{rec['source']:>9}{fmt(rec['wall_s'], '.3f'):>9}"
+              f"{fmt(rec['local_s'], '.3f'):>9}"
+              f"{fmt(rec['wall_s'] - rec['local_s'], '.3f'):>8}"
+              f"{fmt(rec['rows_in'], 'd'):>10}{fmt(rec['rows_out'], 'd'):>10}"
+              f"{fmt(rec['mem_out_mb'], '.1f'):>9}"
+              f"{fmt(rec['rss_peak_delta_mb'], '.1f'):>9}")
+    by_kind = {True: [], False: []}
+    for k, v in report['call_s_by_kind'].items():
+        by_kind[k in EXTERNAL_KINDS].append(f'{k} {v:.3f} s')
+    print(f"total {report['total_s']:.3f} s, peak RSS "
+          f"{fmt(report['peak_rss_mb'], '.0f')} MB"
+          + (f", external calls: {', '.join(by_kind[True])}"
+             if by_kind[True] else '')
+          + (f", timed local calls: {', '.join(by_kind[False])}"
+             if by_kind[False] else ''))
+
+
+def report_path_from_env():
+    """Profiling setting from MARINE_PROFILE: None if disabled, otherwise the
+    report path ('' for the default)."""
+    value = os.environ.get('MARINE_PROFILE', '')
+    if value.lower() in ('', '0', 'false', 'no'):
+        return None
+    return '' if value.lower() in ('1', 'true', 'yes') else value
@@ -0,0 +1,299 @@
+"""
+Monte Carlo propagation of input uncertainty to the exchanges of each route.
+The inputs below are perturbed by lognormal factors with a median of 1 and the
+geometric standard deviations in GSD, drawn independently for each value of
+the input files (e.g. each distance, each emission factor):
+
+    Installed Propulsion Power (kW) and Max Speed (kn)
+        engine_characteristics.csv
+    kW by leg                auxiliary_load.csv, boiler_load.csv
+    EF                       emission_factors.csv (speciated pollutants follow
+                             the pollutant they are derived from)
+    Hotel Time               hotel_hours.csv, hotel_hours_us.csv
+    AvgOfDistance (nm), AvgPctECA
+                             distances.csv
+
+AvgPctECA is a share and is perturbed on the logit scale instead, so that it
+stays within 0 and 1.
+
+The speed, power and time by leg of engine_power and run_timing are evaluated
+as arrays with a leading sample axis, in blocks of samples, and contracted
+with the emission factors and the flow weights of scenario_sweep. The
+unperturbed arrays are checked against those of the pipeline. The GSD can be
+overridden under `Uncertainty` in marine_inputs.yaml.
+
+The result has one row per exchange (route, flow and description) with its
+point value, geometric mean and geometric standard deviation, the parameters
+of an openLCA LOG_NORMAL_DISTRIBUTION uncertainty. Exchanges are identified
+as in the processes by ProcessID, FlowUUID and description, for joining the
+uncertainty to the exchanges of the aggregated df_olca.
+
+    python monte_carlo.py --samples 10000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import process_marine as pm
+import scenario_sweep
+import tensor_engine
+import uuid_cache
+
+# Assumed geometric standard deviations of the inputs
+GSD = {'installed_power': 1.1,
+       'max_speed': 1.05,
+       'auxiliary_load': 1.2,
+       'boiler_load': 1.2,
+       'emission_factors': 1.2,
+       'hotel_hours': 1.3,
+       'distance': 1.1,
+       'pct_eca': 1.2,
+       }
+
+
+def prepare(data_path=pm.data_path):
+    """
+    Base values of the sampled inputs, aligned to the routes, and the
+    emission factor and flow weight arrays.
+    :return: dict
+    """
+    speeds = pm.engine_power(data_path)
+    runs = pm.run_timing(speeds, data_path)
+    run_attrs, time_, power, vessel_idx = tensor_engine.run_arrays(
+        runs, speeds, pm.legs, pm.engines, pm.zones)
+    first = runs.iloc[::len(pm.zones)].reset_index(drop=True)
+    main = vessel_idx[:, pm.engines.index('Main')]
+
+    def vessel(col):
+        return speeds[col].to_numpy(dtype=float)[main]
+
+    def codes(cols):
+        return pd.MultiIndex.from_frame(first[cols]).factorize()[0]
+
+    emissions = pm.load_emission_factors(data_path)
+    fuels = run_attrs['Fuel'].unique()
+    pollutants, ef, zone_mask, elf = tensor_engine.factor_arrays(
+        emissions, fuels, pm.legs, pm.engines, pm.zones)
+    weights, flows = scenario_sweep.flow_weights(pollutants, data_path,
+                                                 by_description=True)
+    weights = weights * zone_mask[:, :, None, None]
+    uncertainty = {**GSD, **pm.load_marine_inputs(data_path)
+                   .get('Uncertainty', {})}
+    base = {
+        'routes': run_attrs[scenario_sweep.ROUTE].astype(object),
+        'installed_power': vessel('Installed Propulsion Power (kW)'),
+        'max_speed': vessel('Max Speed (kn)'),
+        'transit_speed_ratio': vessel('Transit Speed Ratio'),
+        'capacity': vessel('Capacity (metric tons)'),
+        'utilization': np.nan_to_num(vessel('Utilization'), nan=1),
+        # auxiliary and boiler power[run, engine, leg], main engine is zero
+        'engine_load': np.where(np.arange(len(pm.engines))[None, :, None] == 0,
+                                0, np.nan_to_num(power)),
+        'distance': first['AvgOfDistance (nm)'].to_numpy(dtype=float),
+        'pct_eca': first['AvgPctECA'].to_numpy(dtype=float),
+        'distance_idx': codes(['US Region', 'Global Region']),
+        'origin_maneuv_dist': first['OrigManeuv_Distance'].to_numpy(dtype=float),
+        'dest_maneuv_dist': first['DestManeuv_Distance'].to_numpy(dtype=float),
+        'origin_hotel': first['Origin_hotel_time'].to_numpy(dtype=float),
+        'origin_hotel_idx': codes(['Global Region']),
+        'dest_hotel': first['Dest_hotel_time'].to_numpy(dtype=float),
+        'dest_hotel_idx': codes(['Ship Type']),
+        'vessel_idx': codes(['Ship Type', 'Subtype']),
+        'origin_eca': first['Global Region'].isin(pm.ECA_REGIONS)
+                      .to_numpy(dtype=float),
+        'ef': np.nan_to_num(ef) / 1000, # kg by kWh
+        'run_fuel': pd.Index(fuels).get_indexer(run_attrs['Fuel']),
+        'source_idx': pd.factorize(pollutants['Source'])[0],
+        'elf': elf,
+        'weights': weights,
+        'flows': flows,
+        'gsd': uncertainty,
+        }
+    t, p = _timing_power(base, {}, 1)
+    if not (np.allclose(t[0], np.nan_to_num(time_), rtol=1e-12) and
+            np.allclose(p[0], np.nan_to_num(power), rtol=1e-12)):
+        raise ValueError('Time and power differ from those of the pipeline')
+    return base
+
+
+def _factor(rng, n, size, gsd):
+    """Lognormal factors with median 1, array[n, size]."""
+    return np.exp(rng.standard_normal((n, size)) * np.log(gsd))
+
+
+def _draw(base, rng, n):
+    """Factors of each sampled input, indexed to the routes."""
+    gsd = base['gsd']
+    _, n_engines, n_legs = base['engine_load'].shape
+
+    def per(idx, name):
+        return _factor(rng, n, idx.max() + 1, gsd[name])[:, idx]
+
+    n_vessels = base['vessel_idx'].max() + 1
+    load = np.ones((n, n_vessels, n_engines, n_legs))
+    for e, name in [(1, 'auxiliary_load'), (2, 'boiler_load')]:
+        load[:, :, e] = _factor(rng, n, n_vessels * n_legs,
+                                gsd[name]).reshape(n, n_vessels, n_legs)
+    ef = base['ef']
+    sources = _factor(rng, n, ef.shape[0] * ef.shape[1]
+                      * (base['source_idx'].max() + 1),
+                      gsd['emission_factors']).reshape(
+                          n, ef.shape[0], ef.shape[1], -1)
+    return {
+        'installed_power': per(base['vessel_idx'], 'installed_power'),
+        'max_speed': per(base['vessel_idx'], 'max_speed'),
+        'engine_load': load[:, base['vessel_idx']],
+        'distance': per(base['distance_idx'], 'distance'),
+        'pct_eca': per(base['distance_idx'], 'pct_eca'),
+        'origin_hotel': per(base['origin_hotel_idx'], 'hotel_hours'),
+        'dest_hotel': per(base['dest_hotel_idx'], 'hotel_hours'),
+        'ef': sources[..., base['source_idx']],
+        }
+
+
+def _timing_power(base, factors, n, sm_open=pm.SM_OPEN,
+                  sm_coastal=pm.SM_COASTAL, anch_time=pm.ANCH_TIME,
+                  anch_speed=pm.ANCH_SPEED,
+                  dest_maneuv_speed=pm.DEST_MANEUV_SPEED,
+                  origin_maneuv_speed=pm.ORIGIN_MANEUV_SPEED):
+    """
+    time[sample, run, zone, leg] and power[sample, run, engine, leg] as in
+    engine_power and run_timing, with the base inputs scaled by factors.
+    """
+    def value(key):
+        return base[key] * factors.get(key, np.ones((n,) + base[key].shape))
+
+    legs = {l: i for i, l in enumerate(pm.legs)}
+    max_speed = value('max_speed')
+    transit_speed = max_speed * base['transit_speed_ratio']
+    maneuv_speed = np.mean([dest_maneuv_speed, origin_maneuv_speed])
+    installed = value('installed_power')
+    power = value('engine_load')
+    power[:, :, 0, legs['Transit']] = (
+        installed * base['transit_speed_ratio'] ** 3 * sm_open)
+    power[:, :, 0, legs['Maneuvering']] = (
+        installed * (maneuv_speed / max_speed) ** 3 * sm_coastal)
+    power[:, :, 0, legs['Anchorage']] = (
+        installed * (anch_speed / max_speed) ** 3 * sm_coastal)
+
+    total = value('distance') / transit_speed
+    origin_maneuv = base['origin_maneuv_dist'] / origin_maneuv_speed
+    dest_maneuv = base['dest_maneuv_dist'] / dest_maneuv_speed
+    # the odds of ECA are scaled, i.e. the factor is applied on the logit scale
+    odds = value('pct_eca')
+    pct_eca = odds / (odds + 1 - base['pct_eca'])
+    time_ = np.empty(total.shape + (len(pm.zones), len(pm.legs)))
+    for z, in_eca in [(0, True), (1, False)]:
+        def share(x):
+            return x if in_eca else 1 - x
+        time_[:, :, z, legs['Transit']] = (
+            (total - origin_maneuv - dest_maneuv)
+            * share(pct_eca))
+        time_[:, :, z, legs['Anchorage']] = total * anch_time * share(1)
+        time_[:, :, z, legs['Maneuvering']] = (
+            origin_maneuv * share(base['origin_eca']) + dest_maneuv * share(1))
+        time_[:, :, z, legs['Port']] = (
+            value('origin_hotel') * share(base['origin_eca'])
+            + value('dest_hotel') * share(1))
+    return time_, np.nan_to_num(power)
+
+
+def _amounts(base, factors, n, apply_elf=False):
+    """Amount of each flow per t*km, array[sample, run, flow]."""
+    time_, power = _timing_power(base, factors, n)
+    ef = base['ef'] * factors['ef'] if 'ef' in factors else base['ef'][None]
+    weights = base['weights'] # [pollutant, zone, leg, flow]
+    if apply_elf:
+        weights = weights * base['elf'][:, None, :, None]
+    n_p, n_zones, n_legs, n_flows = weights.shape
+    # flow by kWh, [sample, fuel, zone * leg * engine, flow]
+    per_kwh = ((ef.transpose(0, 2, 1, 3).reshape(-1, n_p)
+                @ weights.reshape(n_p, -1))
+               .reshape(ef.shape[0], ef.shape[2], ef.shape[1], n_zones, n_legs,
+                        n_flows)
+               .transpose(0, 1, 3, 4, 2, 5)
+               .reshape(ef.shape[0], ef.shape[2], -1, n_flows))
+    # energy[sample, run, zone * leg * engine]
+    energy = (time_[..., None] * power.transpose(0, 1, 3, 2)[:, :, None]
+              ).reshape(n, time_.shape[1], -1)
+    amounts = np.empty((n, time_.shape[1], n_flows))
+    for fuel in range(ef.shape[2]):
+        runs = base['run_fuel'] == fuel
+        amounts[:, runs] = energy[:, runs] @ per_kwh[:, fuel]
+    distance = base['distance'] * factors.get('distance', 1)
+    tkm = distance * pm.NM_to_KM * base['capacity'] * base['utilization']
+    return amounts / tkm[..., None]
+
+
+def simulate(samples=10000, seed=0, block_size=500, apply_elf=False,
+             data_path=pm.data_path, base=None):
+    """
+    :param samples: int, number of Monte Carlo samples
+    :param block_size: int, samples evaluated at a time, bounds memory
+    :param apply_elf: bool, scale Anchorage and Maneuvering emissions by the
+        low load adjustment factor (the pipeline does not apply the ELF)
+    :return: df, one row per exchange with the point value (amount), geomMean
+        and geomSd, and the number of samples in which it was positive
+    """
+    base = base or prepare(data_path)
+    rng = np.random.default_rng(seed)
+    point = _amounts(base, {}, 1, apply_elf)[0]
+    r, f = np.nonzero(point != 0)
+    # moments of log(sample / point), over the positive samples
+    log_point = np.log(np.abs(point[r, f]))
+    positive = np.zeros(len(r))
+    total = np.zeros(len(r))
+    squares = np.zeros(len(r))
+    for start in range(0, samples, block_size):
+        n = min(block_size, samples - start)
+        values = _amounts(base, _draw(base, rng, n), n, apply_elf)[:, r, f]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logs = np.log(values) - log_point
+        logs[~(values > 0)] = 0
+        positive += (values > 0).sum(axis=0)
+        total += logs.sum(axis=0)
+        squares += (logs ** 2).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / positive
+        var = np.maximum(squares / positive - mean ** 2, 0)
+
+    df = pd.concat([base['routes'].iloc[r].reset_index(drop=True),
+                    base['flows'].iloc[f].reset_index(drop=True)], axis=1)
+    # identify the exchanges as in the processes: the fuel input is the
+    # technosphere flow of the fuel mapping
+    fuel_df = pd.read_csv(data_path / 'Marine_fuel_mapping.csv')
+    _, flow_objs, _ = pm.prepare_tech_flow_mappings(fuel_df, auth=pm.auth)
+    fuel_names = fuel_df.set_index('SourceFlowName')['TargetFlowName']
+    fuel = df['FlowName'].isna()
+    df['FlowName'] = df['FlowName'].fillna(df['Fuel'].map(fuel_names))
+    df['FlowUUID'] = df['FlowUUID'].mask(fuel, df['FlowName'].map(
+        {name: flow.id for name, flow in flow_objs.items()}))
+    df.insert(0, 'ProcessID', uuid_cache.uuids(pm.process_names(df)))
+    uuid_cache.save()
+    return df.assign(amount = point[r, f],
+                     distributionType = 'LOG_NORMAL_DISTRIBUTION',
+                     geomMean = np.exp(log_point + mean),
+                     geomSd = np.exp(np.sqrt(var)),
+                     samples = positive.astype(int),
+                     )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--apply-elf', action='store_true',
+                        help='apply the low load adjustment factor')
+    parser.add_argument('--output', default=str(
+        pm.out_path / 'marine_uncertainty.csv'),
+        help='results file, .csv or .parquet')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    df = simulate(args.samples, seed=args.seed, apply_elf=args.apply_elf)
+    path = scenario_sweep.write(df, args.output)
+    print(f'{args.samples} samples, {len(df)} exchanges in '
+          f'{time.perf_counter() - start:.1f} s, written to {path}')
@@ -0,0 +1,164 @@
+"""
+Builds the openLCA process objects from the exchange table. Process metadata
+is compiled once into a template in which placeholders such as [SHIP_TYPE] or
+[PORT] are slots filled per process, and processes can be built across a
+process pool.
+"""
+
+import re
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+PLACEHOLDER = re.compile(r'(\[[^\[\]]+\])')
+
+# Placeholders filled per process, by the exchange table column they are
+# derived from
+PROCESS_FIELDS = {'[SHIP_TYPE]': 'Ship Type',
+                  '[FUEL]': 'Fuel',
+                  '[PORT]': 'Global Region',
+                  '[DESTINATION]': 'US Region',
+                  '[Capacity (metric tons)]': 'Capacity (metric tons)',
+                  '[Subtype]': 'Subtype',
+                  '[Utilization]': 'Utilization',
+                  }
+
+
+def _compile(text, constants):
+    """Split text into literal parts and per process slots, substituting
+    constant placeholders."""
+    parts = []
+    for i, part in enumerate(PLACEHOLDER.split(text)):
+        slot = i % 2 == 1 and (part in PROCESS_FIELDS
+                               or part == '[SHIP DESCRIPTION]')
+        if not slot:
+            part = constants.get(part, part)
+            if parts and not parts[-1][0]:
+                parts[-1] = (False, parts[-1][1] + part)
+                continue
+        parts.append((slot, part))
+    return tuple(parts)
+
+
+def _render(parts, values):
+    return ''.join(values[p] if slot else p for slot, p in parts)
+
+
+def compile_meta_template(process_meta, constants):
+    """
+    :param process_meta: dict, process metadata including 'ship_description'
+    :param constants: dict, placeholder to string for values that are the
+        same for all processes, e.g. {'[YEAR]': '2023'}
+    """
+    meta = dict(process_meta)
+    ship_desc = {k: _compile(v.rstrip(), constants)
+                 for k, v in meta.pop('ship_description').items()}
+    fields = {k: _compile(v, constants) if isinstance(v, str) else v
+              for k, v in meta.items()}
+    return {'fields': fields, 'ship_description': ship_desc,
+            'text': {k for k, v in meta.items() if isinstance(v, str)}}
+
+
+def process_values(keys):
+    """Placeholder values for a process from its attributes."""
+    return {'[SHIP_TYPE]': keys['Ship Type'].title(),
+            '[FUEL]': keys['Fuel'],
+            '[PORT]': keys['Global Region'],
+            '[DESTINATION]': keys['US Region'],
+            '[Capacity (metric tons)]': str(keys['Capacity (metric tons)']),
+            '[Subtype]': keys['Subtype'],
+            '[Utilization]': str(keys['Utilization']*100),
+            }
+
+
+def render_meta(template, keys):
+    """Process metadata for a process with attributes `keys`."""
+    values = process_values(keys)
+    vessel = re.sub(r'[^a-zA-Z0-9]', '_',
+                    keys['Ship Type'].replace(',', '')).lower()
+    values['[SHIP DESCRIPTION]'] = _render(
+        template['ship_description'][vessel], values)
+    return {k: _render(v, values) if k in template['text'] else v
+            for k, v in template['fields'].items()}
+
+
+_shared = {}
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def _build_batch(batch):
+    from flcac_utils.generate_processes import build_process_dict
+    processes = {}
+    for chunk, meta in batch:
+        processes.update(build_process_dict(
+            chunk, _shared['flows'], meta=meta,
+            loc_objs=_shared['loc_objs'],
+            source_objs=_shared['source_objs'],
+            actor_objs=_shared['actor_objs'],
+            dq_objs=_shared['dq_objs'],
+            ))
+    return processes
+
+
+def _batches(df_olca, template, batch_size):
+    """Batches of (exchanges, metadata) per process, ordered by ProcessID
+    and built only as they are consumed."""
+    fields = list(PROCESS_FIELDS.values())
+    groups = df_olca.groupby('ProcessID', sort=True)
+    # Attributes missing on some rows (e.g. Capacity and Utilization on the
+    # reference flow) are taken from the rows that have them
+    if (groups[fields].nunique() > 1).any(axis=None):
+        raise ValueError('Process attributes are not constant within '
+                         'each ProcessID')
+    attrs = groups[fields].first().to_dict('index')
+    items = ((chunk, render_meta(template, attrs[pid]))
+             for pid, chunk in groups)
+    while batch := list(islice(items, batch_size)):
+        yield batch
+
+
+def iter_processes(df_olca, template, flows, loc_objs, source_objs,
+                   actor_objs, dq_objs, workers=1, batch_size=16):
+    """
+    Build the process of each ProcessID in df_olca, yielding them one at a
+    time so that they can be written and released as they are built. With
+    workers, at most 2 * workers batches are in progress at a time.
+    :return: generator of (key, process object), ordered by ProcessID
+    """
+    batches = _batches(df_olca, template, batch_size)
+    shared = {'flows': flows, 'loc_objs': loc_objs,
+              'source_objs': source_objs, 'actor_objs': actor_objs,
+              'dq_objs': dq_objs}
+    if workers <= 1:
+        _init_worker(shared)
+        try:
+            for batch in batches:
+                yield from _build_batch(batch).items()
+        finally:
+            _shared.clear()
+        return
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(shared,)) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(_build_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result().items()
+        while pending:
+            yield from pending.popleft().result().items()
+
+
+def build_processes(df_olca, template, flows, loc_objs, source_objs,
+                    actor_objs, dq_objs, workers=1, batch_size=16):
+    """
+    Build a process dict for each ProcessID in df_olca.
+    :param workers: int, number of worker processes, 1 to build serially
+    :param batch_size: int, processes sent to a worker at a time
+    :return: dict of process objects, ordered by ProcessID
+    """
+    return dict(iter_processes(df_olca, template, flows, loc_objs,
+                               source_objs, actor_objs, dq_objs,
+                               workers=workers, batch_size=batch_size))
@@ -2,17 +2,37 @@
 Processing of marine LCI data
 """
 
+import argparse
 import yaml
 import pandas as pd
 import numpy as np
 import itertools
 from pathlib import Path
 from statistics import mean
-import re
+
+import commons_cache
+import compact_dtypes
+import dqi
+import flow_crosswalk
+from aggregation import aggregate_exchanges, round_sig_figs
+import instrumentation
+import qa_snapshots
+import route_lookup
+from incremental_export import FolderWriter, export_objects, print_report
+from process_builder import build_processes, compile_meta_template, \
+    iter_processes
+import tensor_engine
+import uuid_cache
+import voyage_ingest
+from commons_cache import get_object, prepare_tech_flow_mappings
+from stage_cache import Stage, StagePipeline
+from streaming_export import TeeWriter, ZipWriter, write_stream
 
 auth = True
 parent_path = Path(__file__).parent
 data_path =  parent_path / 'data'
+cache_path = parent_path / '.cache' / 'stages'
+out_path = parent_path / 'output'
 
 NM_to_KM = 1.852 # km per nautical mile
 ANCH_SPEED = 0 # No propulsion used while at anchorage
@@ -22,470 +42,849 @@ ANCH_TIME = 0.065 # Assumes 6.5% of total time
 DEST_MANEUV_SPEED = 3
 ORIGIN_MANEUV_SPEED = 5.5
 
-#%% 1. Prepare dataset of marine vessels and routes
-
-with open(data_path / "marine_inputs.yaml", "r") as file:
-    marine_inputs = yaml.safe_load(file)
-
-marine_runs0 = pd.read_csv(data_path / 'marine_runs.csv')
-distances = pd.read_csv(data_path / 'distances.csv')
-
-# Prepare the engine specs
-speeds = (pd.read_csv(data_path / 'engine_characteristics.csv')
-          .merge(pd.read_csv(data_path / 'utilization.csv'), how='left',
-                 on='Ship Type')
-          # Subset the df for relevant ship types
-          .query('`Ship Type`.isin(@marine_runs0["Ship Type"])')
-          .query('Subtype.isin(@marine_runs0["Subtype"])')
-          # .assign(Avg_cruise_draft = lambda x: x['Max Draft (m)'] * 0.6)
-          .merge(pd.read_csv(data_path / 'transit_speed_ratios.csv'),
-                 how='left', on='Ship Type')
-          .assign(Transit_speed = lambda x:
-                  x['Max Speed (kn)'] * x['Transit Speed Ratio'])
-          .assign(Maneuvering_speed = mean([DEST_MANEUV_SPEED, ORIGIN_MANEUV_SPEED]))
-          .assign(Anchorage_speed = ANCH_SPEED)
-          # Load = (speed / max speed)^ 3  Propellers Law
-          .assign(Transit_load = lambda x:
-                  pow(x['Transit_speed'] / x['Max Speed (kn)'], 3))
-          .assign(Maneuvering_load = lambda x:
-                  pow(x['Maneuvering_speed'] / x['Max Speed (kn)'], 3))
-          .assign(Anchorage_load = lambda x:
-                  pow(x['Anchorage_speed'] / x['Max Speed (kn)'], 3))
-          )
-
-# Duplicate the dataframe for the other engine types and merge in those loads
-speeds2 = (
-    pd.DataFrame(np.repeat(speeds.values, 2, axis=0), columns=speeds.columns)
-          .assign(Engine = np.tile(['Auxiliary', 'Boiler'], len(speeds))))
-speeds2 = (speeds2
-          .merge(pd.read_csv(data_path / 'auxiliary_load.csv')
-                 .assign(Engine = 'Auxiliary'),
-                 how='left', on=['Ship Type', 'Subtype', 'Engine'])
-          .merge(pd.read_csv(data_path / 'boiler_load.csv')
-                 .assign(Engine = 'Boiler'),
-                 how='left', on=['Ship Type', 'Subtype', 'Engine'],
-                 suffixes = ('', '_')))
-cols = ['Transit (kW)', 'Maneuvering (kW)', 'Hotelling (kW)', 'Anchorage (kW)']
-for col in cols:
-    speeds2[col] = speeds2[col].fillna(speeds2[f'{col}_'])
-speeds2 = speeds2.drop(columns=speeds2.filter(regex='_$').columns)
-
-# Calculate power for each engine type
-speeds = (pd.concat([
-    (speeds
-          .assign(Transit_power = lambda x:
-                  x['Installed Propulsion Power (kW)'] * x['Transit_load'] * SM_OPEN)
-          .assign(Maneuvering_power = lambda x:
-                  x['Installed Propulsion Power (kW)'] * x['Maneuvering_load'] * SM_COASTAL)
-          .assign(Anchorage_power = lambda x:
-                  x['Installed Propulsion Power (kW)'] * x['Anchorage_load'] * SM_COASTAL)
-          # ^^ Account for sea margin in the Propellers Law
-          .assign(Port_power = 0)
-          .assign(Engine = 'Main')),
-     speeds2], ignore_index=True)
-    .assign(Transit_power = lambda x:
-            x['Transit_power'].fillna(x['Transit (kW)']))
-    .assign(Maneuvering_power = lambda x:
-            x['Maneuvering_power'].fillna(x['Maneuvering (kW)']))
-    .assign(Anchorage_power = lambda x:
-            x['Anchorage_power'].fillna(x['Anchorage (kW)']))
-    .assign(Port_power = lambda x:
-            x['Port_power'].fillna(x['Hotelling (kW)']))
-    .drop(columns=cols)
-    )
-del(speeds2)
-
-
-# Calculate time for each run by leg
-marine_runs = (marine_runs0
-      .merge(distances, how='left', on=['US Region', 'Global Region'])
-      .merge(speeds.filter(['Ship Type', 'Subtype', 'Transit_speed']).drop_duplicates(),
-             how='left', on=['Ship Type', 'Subtype'])
-      .assign(Total_time = lambda x: x['AvgOfDistance (nm)'] / x['Transit_speed'])
-      .merge(pd.read_csv(data_path / 'hotel_hours.csv')
-             .rename(columns={'Hotel Time': 'Origin_hotel_time'}),
-             how='left', on='Global Region')
-      .assign(Origin_maneuv_time = lambda x: x['OrigManeuv_Distance'] / ORIGIN_MANEUV_SPEED)
-      .assign(Dest_maneuv_time = lambda x: x['DestManeuv_Distance'] / DEST_MANEUV_SPEED)
-      .assign(Dest_anchor_time = lambda x: x['Total_time'] * ANCH_TIME)
-      .merge(pd.read_csv(data_path / 'hotel_hours_us.csv')
-             .rename(columns={'Hotel Time': 'Dest_hotel_time'}),
-             how='left', on='Ship Type')
-      .assign(Transit_time = lambda x:
-              x['Total_time'] - x['Origin_maneuv_time'] - x['Dest_maneuv_time'])
-      )
-
 legs = ['Transit', 'Anchorage', 'Maneuvering', 'Port']
 engines = ['Main', 'Auxiliary', 'Boiler']
 zones = ['ECA', 'nonECA']
+# Origin regions within an ECA, US destinations are all in the ECA
+ECA_REGIONS = ['Europe', 'Eastern Canada', 'Western Canada', 'Gulf of Mexico',
+               'Western Mexico']
+
+# Speciation bases that fan out to more than one emission factor pollutant
+BASIS_POLLUTANTS = {'PM2.5': ['PM25 ECA', 'PM25 nonECA']}
+
+def speciate_emissions(emissions, speciation_df):
+    """
+    Append speciated (secondary) emission factors to the primary factors.
+    Each speciation profile is joined to the pollutant(s) matching its Basis
+    and the EF is scaled by the profile Fraction.
+    """
+    basis = (speciation_df
+             .assign(Basis_Pollutant = lambda x: x['Basis'].map(
+                 lambda b: BASIS_POLLUTANTS.get(b, [b])))
+             .explode('Basis_Pollutant')
+             .filter(['Basis_Pollutant', 'Pollutant', 'Fraction'])
+             .rename(columns={'Pollutant': 'Species'})
+             )
+    secondary = (emissions
+                 .merge(basis, how='inner', left_on='Pollutant',
+                        right_on='Basis_Pollutant')
+                 .assign(Pollutant = lambda x: x['Species'])
+                 .assign(EF = lambda x: x['EF'] * x['Fraction'])
+                 .assign(em_flag = 'secondary')
+                 .filter(emissions.columns)
+                 )
+    return pd.concat([emissions, secondary], ignore_index=True)
 
-## Assign ECA ratios and calculate total time
-for l in [x for x in legs if x != 'Transit']:
-    marine_runs[f'Dest_{l}_ECA'] = 1 # US is in ECA
-    marine_runs[f'Origin_{l}_ECA'] = np.where(
-        marine_runs['Global Region']
-        .isin(['Europe', 'Eastern Canada', 'Western Canada',
-               'Gulf of Mexico', 'Western Mexico']),
-        1, 0)
-## TRANSIT ECA based on lookup
-marine_runs['Transit_ECA'] = marine_runs['AvgPctECA']
-
-
-marine_runs = (marine_runs
-      .merge(pd.DataFrame(zones, columns=['Zone']), how='cross')
-      .assign(Anchorage_time = lambda x: np.where(x['Zone'] == 'ECA',
-              x['Dest_anchor_time'] * x['Dest_Anchorage_ECA'],
-              x['Dest_anchor_time'] * (1-x['Dest_Anchorage_ECA'])))
-      .assign(Maneuvering_time = lambda x: np.where(x['Zone'] == 'ECA',
-              x['Origin_maneuv_time'] * x['Origin_Maneuvering_ECA']
-              + x['Dest_maneuv_time'] * x['Dest_Maneuvering_ECA'],
-              x['Origin_maneuv_time'] * (1-x['Origin_Maneuvering_ECA'])
-              + x['Dest_maneuv_time'] * (1-x['Dest_Maneuvering_ECA'])))
-      .assign(Port_time = lambda x: np.where(x['Zone'] == 'ECA',
-              x['Origin_hotel_time'] * x['Origin_Port_ECA']
-              + x['Dest_hotel_time'] * x['Dest_Port_ECA'],
-              x['Origin_hotel_time'] * (1-x['Origin_Port_ECA'])
-              + x['Dest_hotel_time'] * (1-x['Dest_Port_ECA'])))
-      .assign(Transit_time = lambda x: np.where(x['Zone'] == 'ECA',
-              x['Transit_time'] * x['Transit_ECA'],
-              x['Transit_time'] * (1-x['Transit_ECA'])))
-      .drop(columns = marine_runs.filter(regex='^.*?(_ECA).*?').columns)
-      )
-
-# Combine all permutations and calculate energy use by leg and engine
-df = (marine_runs
-       .merge(pd.DataFrame(list(itertools.product(legs, engines)),
-                           columns=['Leg', 'Engine']),
-              how='cross')
-       .merge(speeds, how='left', on=['Ship Type', 'Subtype', 'Engine'])
-       )
-for l in legs:
-    df[f'{l}_energy'] = np.where(
-        df['Leg'] == l, df[f'{l}_time'] * df[f'{l}_power'], 0)
-df_qa = df.copy()
-df = df.drop(columns=df.filter(
-    regex=('^.*?(speed|Speed|load|time|Time|Draft|draft|power|'
-           'AvgPctECA|Maneuv_Dist).*?')).columns)
-
-#%% 2. Pull in emission factors and generate combined dataset
 
-# Bring in Emission Factors
-emissions = (pd.read_csv(data_path / 'emission_factors.csv')
-             .melt(id_vars = ['Engine', 'Fuel'],
-                   var_name = 'Pollutant',
-                   value_name = 'EF')
-             .assign(em_flag = 'primary')
-             )
+def load_marine_inputs(data_path=data_path):
+    with open(data_path / "marine_inputs.yaml", "r") as file:
+        return yaml.safe_load(file)
 
-# Apply speciation
-speciation_df = pd.read_csv(data_path / 'flow_speciation.csv')
-# Create a mapping from Basis to list of matching Pollutants
-pollutant_mapping = {}
-for basis in speciation_df['Basis'].unique():
-    if basis == 'PM2.5':
-        # PM2.5 applies to both PM2.5 ECA and PM2.5 nonECA
-        pollutant_mapping[basis] = ['PM25 ECA', 'PM25 nonECA']
-    else:
-        pollutant_mapping[basis] = [basis]
-new_rows = []
-for _, emission_row in emissions.iterrows():
-    pollutant = emission_row['Pollutant']
-    for _, spec_row in speciation_df.iterrows():
-        basis = spec_row['Basis']
-        if pollutant in pollutant_mapping.get(basis, []):
-            new_row = emission_row.copy()
-            new_row['Pollutant'] = spec_row['Pollutant']  # Replace with speciated pollutant name
-            new_row['EF'] = emission_row['EF'] * spec_row['Fraction']  # Adjust EF
-            new_row['em_flag'] = 'secondary'
-            new_rows.append(new_row)
-
-# Append the new rows to the original emissions dataframe
-emissions = pd.concat([emissions, pd.DataFrame(new_rows)], ignore_index=True)
-
-elf = pd.read_csv(data_path / 'engine_load_factor.csv')
-elf.columns = ['Pollutant', 'ELF']
-## TODO: confirm all the load factors are accounted for
-emissions = (emissions
-             .merge(elf, how='left', on='Pollutant')
-             .assign(ELF = lambda x: x['ELF'].fillna(1.0))
-             )
+#%% 1. Prepare dataset of marine vessels and routes
 
-df = (df
-      .merge(emissions, how='left', on=['Engine', 'Fuel'])
-      .assign(ELF = lambda x: np.where(x['Leg'].isin(['Transit', 'Port']), 1,
-                                       x['ELF']))
-      ## ^^ ELF only applies to Anchorage or Maneuvering
-      .assign(description = lambda x:
-              np.select([x['Pollutant'].str.contains(' ECA'),
-                         x['Pollutant'].str.contains('nonECA')],
-                        ['ECA', 'nonECA'], default=''))
-      .query('~(description == "ECA" and Zone == "nonECA")')
-      .query('~(description == "nonECA" and Zone == "ECA")')
-      # Drop ECA from the pollutant name, no longer needed
-      .assign(Pollutant = lambda x:
-              x['Pollutant'].str.replace(r'(ECA|nonECA)', '', regex=True).str.strip())
-      .assign(EF_Unit = 'g / kWh')
-      .assign(Energy = lambda x: x[[f'{c}_energy' for c in legs]].sum(axis=1))
-      .assign(FlowTotal = lambda x: x['EF'] * x['Energy'] / 1000)
-      .assign(Unit = 'kg')
-      .drop(columns=df.filter(regex='^.*?(energy).*?').columns)
-      # Add tons for validation to original file
-      .assign(tons = lambda x: x['FlowTotal'] * .00110231)
-      )
-
-
-## Assign specific contexts based on the leg
-## TODO: also consider locations? Destination for anchorage, maneuv and hotel
-# should be assigned to US, while the origin should be assigned to foreign country?
-# Transit emissions are unassigned and/or GLO? May need to maintain dest/origin
-# designation which are dropped by now
-df = (df
-      .assign(Context = lambda x: x.apply(
-          lambda row: "/".join([row['Zone'], row['Leg']]), axis=1))
-      )
-
-df_qa2 = df.copy()
-## Drop unneccesary fields
-df = df.drop(columns=['Engine Category', 'Engine Type',
-                      'Installed Propulsion Power (kW)',
-                      'EF', 'ELF', 'EF_Unit'])
+def read_input(data_path, name, inputs=None):
+    """Input file `name` from `inputs` (dict of frames by file name) where
+    given, otherwise read from data_path."""
+    if inputs is not None and name in inputs:
+        return inputs[name]
+    return pd.read_csv(data_path / name)
+
+
+def engine_power(data_path=data_path, sm_open=SM_OPEN, sm_coastal=SM_COASTAL,
+                 anch_speed=ANCH_SPEED, dest_maneuv_speed=DEST_MANEUV_SPEED,
+                 origin_maneuv_speed=ORIGIN_MANEUV_SPEED, transit_speed_factor=1,
+                 inputs=None):
+    """Speed, load and power by leg for each vessel and engine.
+    :param transit_speed_factor: float, scales the transit speed ratios
+    :param inputs: dict of input frames by file name, see read_input
+    """
+    marine_runs0 = read_input(data_path, 'marine_runs.csv', inputs)
+
+    # Prepare the engine specs
+    speeds = (read_input(data_path, 'engine_characteristics.csv', inputs)
+              .merge(read_input(data_path, 'utilization.csv', inputs), how='left',
+                     on='Ship Type')
+              # Subset the df for relevant ship types
+              .query('`Ship Type`.isin(@marine_runs0["Ship Type"])')
+              .query('Subtype.isin(@marine_runs0["Subtype"])')
+              # .assign(Avg_cruise_draft = lambda x: x['Max Draft (m)'] * 0.6)
+              .merge(read_input(data_path, 'transit_speed_ratios.csv', inputs),
+                     how='left', on='Ship Type')
+              .assign(Transit_speed = lambda x:
+                      x['Max Speed (kn)'] * x['Transit Speed Ratio']
+                      * transit_speed_factor)
+              .assign(Maneuvering_speed = mean([dest_maneuv_speed, origin_maneuv_speed]))
+              .assign(Anchorage_speed = anch_speed)
+              # Load = (speed / max speed)^ 3  Propellers Law
+              .assign(Transit_load = lambda x:
+                      pow(x['Transit_speed'] / x['Max Speed (kn)'], 3))
+              .assign(Maneuvering_load = lambda x:
+                      pow(x['Maneuvering_speed'] / x['Max Speed (kn)'], 3))
+              .assign(Anchorage_load = lambda x:
+                      pow(x['Anchorage_speed'] / x['Max Speed (kn)'], 3))
+              )
+
+    # Duplicate the dataframe for the other engine types and merge in those loads
+    speeds2 = (
+        pd.DataFrame(np.repeat(speeds.values, 2, axis=0), columns=speeds.columns)
+              .assign(Engine = np.tile(['Auxiliary', 'Boiler'], len(speeds))))
+    speeds2 = (speeds2
+              .merge(read_input(data_path, 'auxiliary_load.csv', inputs)
+                     .assign(Engine = 'Auxiliary'),
+                     how='left', on=['Ship Type', 'Subtype', 'Engine'])
+              .merge(read_input(data_path, 'boiler_load.csv', inputs)
+                     .assign(Engine = 'Boiler'),
+                     how='left', on=['Ship Type', 'Subtype', 'Engine'],
+                     suffixes = ('', '_')))
+    cols = ['Transit (kW)', 'Maneuvering (kW)', 'Hotelling (kW)', 'Anchorage (kW)']
+    for col in cols:
+        speeds2[col] = speeds2[col].fillna(speeds2[f'{col}_'])
+    speeds2 = speeds2.drop(columns=speeds2.filter(regex='_$').columns)
+
+    # Calculate power for each engine type
+    speeds = (pd.concat([
+        (speeds
+              .assign(Transit_power = lambda x:
+                      x['Installed Propulsion Power (kW)'] * x['Transit_load'] * sm_open)
+              .assign(Maneuvering_power = lambda x:
+                      x['Installed Propulsion Power (kW)'] * x['Maneuvering_load'] * sm_coastal)
+              .assign(Anchorage_power = lambda x:
+                      x['Installed Propulsion Power (kW)'] * x['Anchorage_load'] * sm_coastal)
+              # ^^ Account for sea margin in the Propellers Law
+              .assign(Port_power = 0)
+              .assign(Engine = 'Main')),
+         speeds2], ignore_index=True)
+        .assign(Transit_power = lambda x:
+                x['Transit_power'].fillna(x['Transit (kW)']))
+        .assign(Maneuvering_power = lambda x:
+                x['Maneuvering_power'].fillna(x['Maneuvering (kW)']))
+        .assign(Anchorage_power = lambda x:
+                x['Anchorage_power'].fillna(x['Anchorage (kW)']))
+        .assign(Port_power = lambda x:
+                x['Port_power'].fillna(x['Hotelling (kW)']))
+        .drop(columns=cols)
+        )
+    return speeds
+
+
+def run_timing(speeds, data_path=data_path, anch_time=ANCH_TIME,
+               dest_maneuv_speed=DEST_MANEUV_SPEED,
+               origin_maneuv_speed=ORIGIN_MANEUV_SPEED, compact=False,
+               distances=None, inputs=None):
+    """Time by leg ({leg}_time columns) for each run and zone.
+    :param distances: df in the columns of distances.csv, optionally also by
+        Ship Type and Subtype (see voyage_ingest), defaults to distances.csv
+    :param inputs: dict of input frames by file name, see read_input
+    """
+    marine_runs0 = read_input(data_path, 'marine_runs.csv', inputs)
+    if distances is None:
+        distances = read_input(data_path, 'distances.csv', inputs)
+    route = [c for c in ['US Region', 'Global Region', 'Ship Type', 'Subtype']
+             if c in distances]
+    hotel_hours = read_input(data_path, 'hotel_hours.csv', inputs)
+    hotel_hours_us = read_input(data_path, 'hotel_hours_us.csv', inputs)
+    zone_df = pd.DataFrame(zones, columns=['Zone'])
+    if compact:
+        (marine_runs0, distances, hotel_hours, hotel_hours_us, zone_df,
+         speeds) = compact_dtypes.categorize(marine_runs0, distances,
+                                             hotel_hours, hotel_hours_us,
+                                             zone_df, speeds)
+
+    # Calculate time for each run by leg
+    marine_runs = (marine_runs0
+          .merge(distances, how='left', on=route)
+          .merge(speeds.filter(['Ship Type', 'Subtype', 'Transit_speed']).drop_duplicates(),
+                 how='left', on=['Ship Type', 'Subtype'])
+          .assign(Total_time = lambda x: x['AvgOfDistance (nm)'] / x['Transit_speed'])
+          .merge(hotel_hours
+                 .rename(columns={'Hotel Time': 'Origin_hotel_time'}),
+                 how='left', on='Global Region')
+          .assign(Origin_maneuv_time = lambda x: x['OrigManeuv_Distance'] / origin_maneuv_speed)
+          .assign(Dest_maneuv_time = lambda x: x['DestManeuv_Distance'] / dest_maneuv_speed)
+          .assign(Dest_anchor_time = lambda x: x['Total_time'] * anch_time)
+          .merge(hotel_hours_us
+                 .rename(columns={'Hotel Time': 'Dest_hotel_time'}),
+                 how='left', on='Ship Type')
+          .assign(Transit_time = lambda x:
+                  x['Total_time'] - x['Origin_maneuv_time'] - x['Dest_maneuv_time'])
+          )
 
-#%% 3. Align elementary flows with FEDEFL
-from esupy.mapping import apply_flow_mapping
-from esupy.util import make_uuid
-
-kwargs = {}
-kwargs['material_crosswalk'] = (data_path /
-                                'Marine_fedefl_flow_mapping.csv')
-## ^^ hack to pass a local mapping file
-
-mapped_df = apply_flow_mapping(
-    df=df, source=None, flow_type='ELEMENTARY_FLOW',
-    keep_unmapped_rows=True, ignore_source_name=True,
-    field_dict = {
-        'SourceName': '',
-        'FlowableName': 'Pollutant',
-        'FlowableUnit': 'Unit',
-        'FlowableContext': 'Context',
-        'FlowableQuantity': 'FlowTotal',
-        'UUID': 'FlowUUID'},
-    **kwargs
-    ).rename(columns={'Pollutant': 'FlowName'})
-
-#%% Convert to reference unit
-from flcac_utils.util import round_to_sig_figs
-mapped_df = (mapped_df
-             .assign(FlowAmount = lambda x: x['FlowTotal'] /
-                     (x['AvgOfDistance (nm)'] * NM_to_KM * x['Capacity (metric tons)']
-                      * x['Utilization'].fillna(1)))
-    )
-
-#%% Extract fuel information
-from flcac_utils.mapping import prepare_tech_flow_mappings
-
-## Identify mappings for technosphere flows (fuel inputs)
-fuel_df = pd.read_csv(data_path / 'Marine_fuel_mapping.csv')
-
-fuel_dict, flow_objs, provider_dict = prepare_tech_flow_mappings(fuel_df, auth=auth)
-
-#%% Update the reference_flow_var for each process
-df_olca = pd.concat([mapped_df,
-                     (df[['US Region', 'Global Region', 'Fuel', 'Ship Type',
-                          'Subtype']]
-                      .drop_duplicates()
-                      .assign(reference = True)
-                      .assign(IsInput = False)
-                      .assign(FlowAmount = 1)
-                      .assign(FlowName = 'reference_flow_var')
-                      .assign(description = '')
-                      )], ignore_index=True)
-
-cond1 = df_olca['FlowName'] == 'reference_flow_var'
-cond2 = df_olca['FlowName'] == marine_inputs['EnergyFlow']
-
-df_olca = (df_olca
-           .assign(ProcessName = lambda x: (
-               'Transport, ' + x['Ship Type'].str.lower() + '; '
-               + (x['Fuel'].str.lower()) + ' powered; ' + x['Global Region']
-               + ' to ' + x['US Region']))
-           .assign(ProcessCategory = marine_inputs.get('ProcessContext'))
-           .assign(ProcessID = lambda x: x['ProcessName'].apply(make_uuid))
-           .assign(reference = np.where(cond1, True, False))
-           .assign(IsInput = np.where(cond2, True, False))
-           .assign(FlowType = np.where(cond1 | cond2, 'PRODUCT_FLOW',
-                   'ELEMENTARY_FLOW'))
-           .assign(Unit = np.where(cond1, 't*km', df_olca['Unit']))
-           .assign(FlowName = lambda x: np.where(cond1,
-                   x['ProcessName'].str.rsplit(';', n=1).str.get(0),
-                   x['FlowName']))
-           .assign(Context = np.where(cond1, marine_inputs['FlowContext'],
-                   df_olca['Context']))
-           .assign(FlowUUID = lambda x: np.where(cond1,
-                   x.apply(lambda z: make_uuid(z['FlowName'], z['Context']), axis=1),
-                   x['FlowUUID']))
-           # For fuel values assign fuel as the FlowName
-           .assign(FlowName = lambda x: np.where(cond2, x['Fuel'], x['FlowName']))
+    ## Assign ECA ratios and calculate total time
+    for l in [x for x in legs if x != 'Transit']:
+        marine_runs[f'Dest_{l}_ECA'] = 1 # US is in ECA
+        marine_runs[f'Origin_{l}_ECA'] = np.where(
+            marine_runs['Global Region'].isin(ECA_REGIONS), 1, 0)
+    ## TRANSIT ECA based on lookup
+    marine_runs['Transit_ECA'] = marine_runs['AvgPctECA']
+
+
+    marine_runs = (marine_runs
+          .merge(zone_df, how='cross')
+          .assign(Anchorage_time = lambda x: np.where(x['Zone'] == 'ECA',
+                  x['Dest_anchor_time'] * x['Dest_Anchorage_ECA'],
+                  x['Dest_anchor_time'] * (1-x['Dest_Anchorage_ECA'])))
+          .assign(Maneuvering_time = lambda x: np.where(x['Zone'] == 'ECA',
+                  x['Origin_maneuv_time'] * x['Origin_Maneuvering_ECA']
+                  + x['Dest_maneuv_time'] * x['Dest_Maneuvering_ECA'],
+                  x['Origin_maneuv_time'] * (1-x['Origin_Maneuvering_ECA'])
+                  + x['Dest_maneuv_time'] * (1-x['Dest_Maneuvering_ECA'])))
+          .assign(Port_time = lambda x: np.where(x['Zone'] == 'ECA',
+                  x['Origin_hotel_time'] * x['Origin_Port_ECA']
+                  + x['Dest_hotel_time'] * x['Dest_Port_ECA'],
+                  x['Origin_hotel_time'] * (1-x['Origin_Port_ECA'])
+                  + x['Dest_hotel_time'] * (1-x['Dest_Port_ECA'])))
+          .assign(Transit_time = lambda x: np.where(x['Zone'] == 'ECA',
+                  x['Transit_time'] * x['Transit_ECA'],
+                  x['Transit_time'] * (1-x['Transit_ECA'])))
+          .drop(columns = marine_runs.filter(regex='^.*?(_ECA).*?').columns)
+          )
+    return marine_runs
+
+
+def leg_timing(speeds, distances=None, data_path=data_path,
+               anch_time=ANCH_TIME, dest_maneuv_speed=DEST_MANEUV_SPEED,
+               origin_maneuv_speed=ORIGIN_MANEUV_SPEED, compact=False):
+    """Time by leg and zone for each run, combined with engine power to
+    calculate energy use by leg and engine.
+    :param distances: df of route distances, defaults to distances.csv
+    """
+    marine_runs = run_timing(speeds, data_path, anch_time=anch_time,
+                             dest_maneuv_speed=dest_maneuv_speed,
+                             origin_maneuv_speed=origin_maneuv_speed,
+                             compact=compact, distances=distances)
+    leg_engines = pd.DataFrame(list(itertools.product(legs, engines)),
+                               columns=['Leg', 'Engine'])
+    if compact:
+        marine_runs, leg_engines, speeds = compact_dtypes.categorize(
+            marine_runs, leg_engines, speeds)
+
+    # Combine all permutations and calculate energy use by leg and engine
+    df = (marine_runs
+           .merge(leg_engines, how='cross')
+           .merge(speeds, how='left', on=['Ship Type', 'Subtype', 'Engine'])
            )
+    for l in legs:
+        df[f'{l}_energy'] = np.where(
+            df['Leg'] == l, df[f'{l}_time'] * df[f'{l}_power'], 0)
+    qa_snapshots.save(df, 'energy')
+    df = df.drop(columns=df.filter(
+        regex=('^.*?(speed|Speed|load|time|Time|Draft|draft|power|'
+               'AvgPctECA|Maneuv_Dist).*?')).columns)
+    return df
 
-# Update elementary flows to grams from kg
-df_olca = (df_olca
-           .assign(Unit = lambda x: np.where(x['FlowType']=='ELEMENTARY_FLOW',
-                                             'g', x['Unit']))
-           .assign(FlowAmount = lambda x: np.where(
-               x['FlowType']=='ELEMENTARY_FLOW',
-               x['FlowAmount']*1000, x['FlowAmount']))
-           .assign(location = 'GLO')
-           )
+#%% 2. Pull in emission factors and generate combined dataset
 
-#%% Apply fuel mapping data
-from flcac_utils.mapping import apply_tech_flow_mapping, create_bridge_processes
+def load_emission_factors(data_path=data_path):
+    """Emission factors by engine and fuel including speciated pollutants
+    and the low load adjustment factor (ELF)."""
+    # Bring in Emission Factors
+    emissions = (pd.read_csv(data_path / 'emission_factors.csv')
+                 .melt(id_vars = ['Engine', 'Fuel'],
+                       var_name = 'Pollutant',
+                       value_name = 'EF')
+                 .assign(em_flag = 'primary')
+                 .assign(Source = lambda x: x['Pollutant'])
+                 )
+
+    # Apply speciation
+    emissions = speciate_emissions(emissions,
+                                   pd.read_csv(data_path / 'flow_speciation.csv'))
+
+    elf = pd.read_csv(data_path / 'engine_load_factor.csv')
+    elf.columns = ['Pollutant', 'ELF']
+    ## TODO: confirm all the load factors are accounted for
+    emissions = (emissions
+                 .merge(elf, how='left', on='Pollutant')
+                 .assign(ELF = lambda x: x['ELF'].fillna(1.0))
+                 )
+    return emissions
+
+
+def calculate_emissions(df, data_path=data_path, compact=False):
+    """Apply (speciated) emission factors to the energy use by leg."""
+    emissions = load_emission_factors(data_path)
+    if compact:
+        df, emissions = compact_dtypes.categorize(df, emissions)
+    df = (df
+          .merge(emissions, how='left', on=['Engine', 'Fuel'])
+          .assign(ELF = lambda x: np.where(x['Leg'].isin(['Transit', 'Port']), 1,
+                                           x['ELF']))
+          ## ^^ ELF only applies to Anchorage or Maneuvering
+          .assign(description = lambda x:
+                  np.select([x['Pollutant'].str.contains(' ECA'),
+                             x['Pollutant'].str.contains('nonECA')],
+                            ['ECA', 'nonECA'], default=''))
+          .query('~(description == "ECA" and Zone == "nonECA")')
+          .query('~(description == "nonECA" and Zone == "ECA")')
+          # Drop ECA from the pollutant name, no longer needed
+          .assign(Pollutant = lambda x: compact_dtypes.transform(x['Pollutant'],
+                  lambda p: p.str.replace(r'(ECA|nonECA)', '', regex=True).str.strip()))
+          .assign(EF_Unit = 'g / kWh')
+          .assign(Energy = lambda x: x[[f'{c}_energy' for c in legs]].sum(axis=1))
+          .assign(FlowTotal = lambda x: x['EF'] * x['Energy'] / 1000)
+          .assign(Unit = 'kg')
+          .drop(columns=df.filter(regex='^.*?(energy).*?').columns)
+          # Add tons for validation to original file
+          .assign(tons = lambda x: x['FlowTotal'] * .00110231)
+          )
 
-df_olca = apply_tech_flow_mapping(df_olca.rename(columns={'FlowName':'name',
-                                                          'FlowAmount':'amount',
-                                                          'Unit':'unit'}),
-                                  fuel_dict, flow_objs, provider_dict)
 
-## TODO: fuel consumption has dropped dramatically compared to old data need to
-# do a carbon comparison;
-# based on some checks it seems that the amount of fuel in the old processes is too high
-# given the reported CO2 emissions, and that the CO2 content relative to fuel consumed
-# is more appropriate in the new data
+    ## Assign specific contexts based on the leg
+    ## TODO: also consider locations? Destination for anchorage, maneuv and hotel
+    # should be assigned to US, while the origin should be assigned to foreign country?
+    # Transit emissions are unassigned and/or GLO? May need to maintain dest/origin
+    # designation which are dropped by now
+    df = (df
+          .assign(Context = lambda x: uuid_cache.join(x['Zone'], x['Leg']))
+          )
+    if compact:
+        df = compact_dtypes.categorize(df)
+
+    qa_snapshots.save(df, 'emissions')
+    ## Drop unneccesary fields
+    df = df.drop(columns=['Engine Category', 'Engine Type',
+                          'Installed Propulsion Power (kW)',
+                          'EF', 'ELF', 'EF_Unit', 'Source'])
+    return df
+
+
+def tensor_emissions(speeds, distances=None, data_path=data_path,
+                     anch_time=ANCH_TIME, dest_maneuv_speed=DEST_MANEUV_SPEED,
+                     origin_maneuv_speed=ORIGIN_MANEUV_SPEED, compact=False):
+    """Array based equivalent of leg_timing and calculate_emissions which
+    only emits rows with non-zero emissions."""
+    runs = run_timing(speeds, data_path, anch_time=anch_time,
+                      dest_maneuv_speed=dest_maneuv_speed,
+                      origin_maneuv_speed=origin_maneuv_speed,
+                      compact=compact, distances=distances)
+    df = tensor_engine.emissions_by_leg(
+        runs, speeds, load_emission_factors(data_path),
+        legs=legs, engines=engines, zones=zones)
+    return compact_dtypes.categorize(df) if compact else df
 
-df_olca = (df_olca
-           .query('not(FlowUUID.isna())')
-           .drop(columns=['bridge'], errors='ignore')
-           )
-df_bridge = create_bridge_processes(df_olca, fuel_dict, flow_objs)
-# df_olca.to_csv(parent_path /'marine_processed_output.csv', index=False)
+#%% 3. Align elementary flows with FEDEFL
 
-from flcac_utils.generate_processes import build_flow_dict
-flows, new_flows = build_flow_dict(
-    pd.concat([df_olca, df_bridge], ignore_index=True))
-# pass bridge processes too to ensure those flows get created
+def map_elementary_flows(df, data_path=data_path, nm_to_km=NM_to_KM,
+                         compact=False):
+    """Map emissions to FEDEFL and convert to the reference unit (t*km)."""
+    df = compact_dtypes.decode(df, ['Pollutant', 'Unit', 'Context'])
+    with instrumentation.call('flow_crosswalk', 'local'):
+        index = flow_crosswalk.compile_index(data_path /
+                                             'Marine_fedefl_flow_mapping.csv')
+        mapped_df, unmapped = flow_crosswalk.apply_mapping(
+            df, index, name='Pollutant', context='Context', unit='Unit',
+            quantity='FlowTotal', uuid='FlowUUID')
+    flow_crosswalk.report_unmapped(
+        unmapped, expected=[load_marine_inputs(data_path)['EnergyFlow']])
+    mapped_df = mapped_df.rename(columns={'Pollutant': 'FlowName'})
+
+    # Convert to reference unit
+    mapped_df = (mapped_df
+                 .assign(FlowAmount = lambda x: x['FlowTotal'] /
+                         (x['AvgOfDistance (nm)'] * nm_to_km * x['Capacity (metric tons)']
+                          * x['Utilization'].fillna(1)))
+        )
+    if compact:
+        mapped_df = compact_dtypes.categorize(mapped_df)
+    return mapped_df
+
+#%% Extract fuel information and apply fuel mapping data
+
+def process_names(df):
+    """Name of the process of each row of df, by Ship Type, Fuel, Global
+    Region and US Region."""
+    return ('Transport, ' + df['Ship Type'].str.lower() + '; '
+            + (df['Fuel'].str.lower()) + ' powered; ' + df['Global Region']
+            + ' to ' + df['US Region'])
+
+
+def map_tech_flows(mapped_df, df, data_path=data_path, auth=auth,
+                   compact=False):
+    """Add reference flows, map fuel inputs to technosphere flows and build
+    the flow objects."""
+    from flcac_utils.mapping import apply_tech_flow_mapping, \
+        create_bridge_processes
+    from flcac_utils.generate_processes import build_flow_dict
+
+    marine_inputs = load_marine_inputs(data_path)
+
+    ## Identify mappings for technosphere flows (fuel inputs)
+    fuel_df = pd.read_csv(data_path / 'Marine_fuel_mapping.csv')
+
+    fuel_dict, flow_objs, provider_dict = prepare_tech_flow_mappings(fuel_df, auth=auth)
+
+    # Update the reference_flow_var for each process
+    mapped_df = compact_dtypes.decode(mapped_df)
+    df = compact_dtypes.decode(df, ['US Region', 'Global Region', 'Fuel',
+                                    'Ship Type', 'Subtype'])
+    df_olca = pd.concat([mapped_df,
+                         (df[['US Region', 'Global Region', 'Fuel', 'Ship Type',
+                              'Subtype']]
+                          .drop_duplicates()
+                          .assign(reference = True)
+                          .assign(IsInput = False)
+                          .assign(FlowAmount = 1)
+                          .assign(FlowName = 'reference_flow_var')
+                          .assign(description = '')
+                          )], ignore_index=True)
+
+    cond1 = df_olca['FlowName'] == 'reference_flow_var'
+    cond2 = df_olca['FlowName'] == marine_inputs['EnergyFlow']
+
+    df_olca = (df_olca
+               .assign(ProcessName = process_names)
+               .assign(ProcessCategory = marine_inputs.get('ProcessContext'))
+               .assign(ProcessID = lambda x: uuid_cache.uuids(x['ProcessName']))
+               .assign(reference = np.where(cond1, True, False))
+               .assign(IsInput = np.where(cond2, True, False))
+               .assign(FlowType = np.where(cond1 | cond2, 'PRODUCT_FLOW',
+                       'ELEMENTARY_FLOW'))
+               .assign(Unit = np.where(cond1, 't*km', df_olca['Unit']))
+               .assign(FlowName = lambda x: np.where(cond1,
+                       x['ProcessName'].str.rsplit(';', n=1).str.get(0),
+                       x['FlowName']))
+               .assign(Context = np.where(cond1, marine_inputs['FlowContext'],
+                       df_olca['Context']))
+               .assign(FlowUUID = lambda x: x['FlowUUID'].mask(cond1,
+                       pd.Series(uuid_cache.uuids(x.loc[cond1, 'FlowName'],
+                                                  x.loc[cond1, 'Context']),
+                                 index=x.index[cond1])))
+               # For fuel values assign fuel as the FlowName
+               .assign(FlowName = lambda x: np.where(cond2, x['Fuel'], x['FlowName']))
+               )
+
+    # Update elementary flows to grams from kg
+    df_olca = (df_olca
+               .assign(Unit = lambda x: np.where(x['FlowType']=='ELEMENTARY_FLOW',
+                                                 'g', x['Unit']))
+               .assign(FlowAmount = lambda x: np.where(
+                   x['FlowType']=='ELEMENTARY_FLOW',
+                   x['FlowAmount']*1000, x['FlowAmount']))
+               .assign(location = 'GLO')
+               )
+
+    with instrumentation.call('apply_tech_flow_mapping'):
+        df_olca = apply_tech_flow_mapping(df_olca.rename(columns={'FlowName':'name',
+                                                                  'FlowAmount':'amount',
+                                                                  'Unit':'unit'}),
+                                          fuel_dict, flow_objs, provider_dict)
+
+    ## TODO: fuel consumption has dropped dramatically compared to old data need to
+    # do a carbon comparison;
+    # based on some checks it seems that the amount of fuel in the old processes is too high
+    # given the reported CO2 emissions, and that the CO2 content relative to fuel consumed
+    # is more appropriate in the new data
+
+    df_olca = (df_olca
+               .query('not(FlowUUID.isna())')
+               .drop(columns=['bridge'], errors='ignore')
+               )
+    with instrumentation.call('create_bridge_processes'):
+        df_bridge = create_bridge_processes(df_olca, fuel_dict, flow_objs)
+    # df_olca.to_csv(parent_path /'marine_processed_output.csv', index=False)
+
+    with instrumentation.call('build_flow_dict'):
+        flows, new_flows = build_flow_dict(
+            pd.concat([df_olca, df_bridge], ignore_index=True))
+    # pass bridge processes too to ensure those flows get created
+
+    # replace newly created flows with those pulled via API
+    api_flows = {flow.id: flow for k, flow in flow_objs.items()}
+    if not(flows.keys() | api_flows.keys()) == flows.keys():
+        print('Warning, some flows not consistent')
+    else:
+        flows.update(api_flows)
 
-# replace newly created flows with those pulled via API
-api_flows = {flow.id: flow for k, flow in flow_objs.items()}
-if not(flows.keys() | api_flows.keys()) == flows.keys():
-    print('Warning, some flows not consistent')
-else:
-    flows.update(api_flows)
+    uuid_cache.save()
+    if compact:
+        df_olca = compact_dtypes.categorize(df_olca)
+    return {'df_olca': df_olca, 'df_bridge': df_bridge,
+            'flows': flows, 'new_flows': new_flows}
 
 #%% Assign exchange dqi
-from flcac_utils.util import format_dqi_score, increment_dqi_value
-df_olca['exchange_dqi'] = format_dqi_score(marine_inputs['DQI']['Flow'])
-# update Flow Reliability (position 1)
-df_olca['exchange_dqi'] = np.where(
-    (df_olca['em_flag'] == 'secondary') | (df_olca['IsInput'] == True),
-    df_olca['exchange_dqi'].apply(lambda x: increment_dqi_value(x, 1)),
-    df_olca['exchange_dqi'])
-# update temporarl correlation (position 2)
-df_olca['exchange_dqi'] = np.where(
-    (df_olca['em_flag'] == 'secondary') & (df_olca['FlowType'] == 'ELEMENTARY_FLOW'),
-    df_olca['exchange_dqi'].apply(lambda x: increment_dqi_value(x, 2)),
-    df_olca['exchange_dqi'])
-# drop DQI entry for reference flow
-df_olca['exchange_dqi'] = np.where(df_olca['reference'] == True,
-                                    '', df_olca['exchange_dqi'])
+
+def assign_dqi(tech, data_path=data_path):
+    """Exchange DQI scores as integer columns exchange_dqi_1..n, formatted
+    to strings in build_json."""
+    marine_inputs = load_marine_inputs(data_path)
+    df_olca = tech['df_olca'].copy()
+    scores = dqi.score_array(marine_inputs['DQI']['Flow'], len(df_olca))
+    secondary = (df_olca['em_flag'] == 'secondary').to_numpy()
+    # update Flow Reliability (position 1)
+    dqi.increment(scores, secondary | (df_olca['IsInput'] == True).to_numpy(), 1)
+    # update temporarl correlation (position 2)
+    dqi.increment(scores, secondary &
+                  (df_olca['FlowType'] == 'ELEMENTARY_FLOW').to_numpy(), 2)
+    # drop DQI entry for reference flow
+    scores[(df_olca['reference'] == True).to_numpy()] = 0
+    df_olca[dqi.dqi_columns(scores.shape[1])] = scores
+    return df_olca
 
 #%% Aggregate
 
-df_olca = df_olca.drop(columns=['Energy', 'FlowTotal', 'tons',
-                                 'Zone', 'Leg', 'Engine', 'em_flag',
-                                 'AvgOfDistance (nm)'])
-df_olca = (df_olca
-           .groupby([c for c in df_olca if c not in ['FlowAmount', 'amount']],
-                    dropna=False)
-           .agg('sum')
-           .reset_index()
-           )
-df_olca['amount'] = df_olca['amount'].apply(lambda x: round_to_sig_figs(x, 4))
-
-#%% prepare metadata
-from flcac_utils.generate_processes import build_location_dict
-from flcac_utils.util import assign_year_to_meta, \
-    extract_actors_from_process_meta, extract_dqsystems,\
-    extract_sources_from_process_meta, generate_locations_from_exchange_df
-from flcac_utils.commons_api import get_single_object
-
-with open(data_path / 'Marine_process_metadata.yaml') as f:
-    process_meta = yaml.safe_load(f)
-
-process_meta = assign_year_to_meta(process_meta, marine_inputs['Year'])
-process_meta['time_description'] = (process_meta['time_description']
-                                    .replace('[YEAR]', str(marine_inputs['Year']))
-                                    )
-(process_meta, source_objs) = extract_sources_from_process_meta(
-    process_meta, bib_path = data_path / 'transport.bib')
-(process_meta, actor_objs) = extract_actors_from_process_meta(process_meta)
-dq_objs = extract_dqsystems(marine_inputs['DQI']['dqSystem'])
-process_meta['dq_entry'] = format_dqi_score(marine_inputs['DQI']['Process'])
-
-# prepare locations
-# get GLO location from USLCI
-loc = get_single_object('USLCI', 'LOCATION', '56bca136-90bb-3a77-9abb-7ce558af711e')
-location_objs = {'GLO': loc}
-
-#%% Build json file
-from flcac_utils.generate_processes import \
-    build_process_dict, write_objects, validate_exchange_data
-
-validate_exchange_data(df_olca)
-
-processes = {}
-# loop through each process to adjust metadata before writing processes
-for pid, chunk in df_olca.groupby('ProcessID'):
-    # Identify constant columns (all values same in this chunk)
-    meta = {
-        col: chunk[col].iloc[0] 
-        for col in chunk.columns 
-        if chunk[col].nunique() == 1
-    }
-    vessel_desc = (process_meta['ship_description'].get(
-            re.sub(r'[^a-zA-Z0-9]', '_', meta['Ship Type'].replace(',','')).lower())
-            .rstrip())
-    _process_meta = process_meta.copy()
-    _process_meta.pop('ship_description')
-    for k, v in _process_meta.items():
-        if not isinstance(v, str): continue
-        v = v.replace('[SHIP DESCRIPTION]', vessel_desc)
-        v = v.replace('[SHIP_TYPE]', meta['Ship Type'].title())
-        v = v.replace('[FUEL]', meta['Fuel'])
-        v = v.replace('[PORT]', meta['Global Region'])
-        v = v.replace('[DESTINATION]', meta['US Region'])
-        v = v.replace('[Capacity (metric tons)]', str(meta['Capacity (metric tons)']))
-        v = v.replace('[Subtype]', meta['Subtype'])
-        v = v.replace('[Utilization]', str(meta['Utilization']*100))
-        v = v.replace('[ANCH_TIME]', str(ANCH_TIME*100))
-        v = v.replace('[ORIGIN_MANEUV_SPEED]', str(ORIGIN_MANEUV_SPEED))
-        v = v.replace('[DEST_MANEUV_SPEED]', str(DEST_MANEUV_SPEED))
-        v = v.replace('[SM_COASTAL]', str(SM_COASTAL))
-        v = v.replace('[SM_OPEN]', str(SM_OPEN))
-        v = v.replace('[YEAR]', str(marine_inputs['Year']))
-        _process_meta[k] = v
-    p_dict = build_process_dict(chunk,
-                                flows, meta=_process_meta,
-                                loc_objs=location_objs,
-                                source_objs=source_objs,
-                                actor_objs=actor_objs,
-                                dq_objs=dq_objs,
-                                )
-    processes.update(p_dict)
-# build bridge processes
-bridge_processes = build_process_dict(df_bridge, flows,
-                                      meta=marine_inputs.get('Bridge', {}))
+def aggregate(df_olca, data_path=data_path):
+    """Sum exchanges across legs, zones and engines, grouping on the
+    identifying columns only (see aggregation.py)."""
+    df_olca = df_olca.drop(columns=['Energy', 'FlowTotal', 'tons',
+                                     'Zone', 'Leg', 'Engine', 'em_flag',
+                                     'AvgOfDistance (nm)'])
+    df_olca = aggregate_exchanges(df_olca, sum_cols=['FlowAmount', 'amount'])
+    df_olca['amount'] = round_sig_figs(df_olca['amount'], 4)
+    return df_olca
+
+#%% prepare metadata and build json objects
+
+def prepare_json(df_olca, tech, data_path=data_path, anch_time=ANCH_TIME,
+                 origin_maneuv_speed=ORIGIN_MANEUV_SPEED,
+                 dest_maneuv_speed=DEST_MANEUV_SPEED,
+                 sm_coastal=SM_COASTAL, sm_open=SM_OPEN):
+    """Prepare the exchanges, metadata template and shared openLCA objects
+    from which the processes are built."""
+    from flcac_utils.util import assign_year_to_meta, format_dqi_score, \
+        extract_actors_from_process_meta, extract_dqsystems,\
+        extract_sources_from_process_meta
+    from flcac_utils.generate_processes import validate_exchange_data
+
+    marine_inputs = load_marine_inputs(data_path)
+    df_olca = compact_dtypes.decode(df_olca)
+    flows = tech['flows']
+    df_bridge = tech['df_bridge']
+
+    with open(data_path / 'Marine_process_metadata.yaml') as f:
+        process_meta = yaml.safe_load(f)
+
+    process_meta = assign_year_to_meta(process_meta, marine_inputs['Year'])
+    process_meta['time_description'] = (process_meta['time_description']
+                                        .replace('[YEAR]', str(marine_inputs['Year']))
+                                        )
+    (process_meta, source_objs) = extract_sources_from_process_meta(
+        process_meta, bib_path = data_path / 'transport.bib')
+    (process_meta, actor_objs) = extract_actors_from_process_meta(process_meta)
+    dq_objs = extract_dqsystems(marine_inputs['DQI']['dqSystem'])
+    process_meta['dq_entry'] = format_dqi_score(marine_inputs['DQI']['Process'])
+
+    # prepare locations
+    # get GLO location from USLCI
+    loc = get_object('USLCI', 'LOCATION', '56bca136-90bb-3a77-9abb-7ce558af711e')
+    location_objs = {'GLO': loc}
+
+    df_olca = dqi.format_exchange_dqi(df_olca)
+    with instrumentation.call('validate_exchange_data'):
+        validate_exchange_data(df_olca)
+
+    template = compile_meta_template(process_meta, {
+        '[ANCH_TIME]': str(anch_time*100),
+        '[ORIGIN_MANEUV_SPEED]': str(origin_maneuv_speed),
+        '[DEST_MANEUV_SPEED]': str(dest_maneuv_speed),
+        '[SM_COASTAL]': str(sm_coastal),
+        '[SM_OPEN]': str(sm_open),
+        '[YEAR]': str(marine_inputs['Year']),
+        })
+    return {'df_olca': df_olca, 'template': template, 'flows': flows,
+            'new_flows': tech['new_flows'], 'df_bridge': df_bridge,
+            'bridge_meta': marine_inputs.get('Bridge', {}),
+            'source_objs': source_objs, 'actor_objs': actor_objs,
+            'dq_objs': dq_objs, 'location_objs': location_objs}
+
+
+def build_json(df_olca, tech, data_path=data_path, anch_time=ANCH_TIME,
+               origin_maneuv_speed=ORIGIN_MANEUV_SPEED,
+               dest_maneuv_speed=DEST_MANEUV_SPEED,
+               sm_coastal=SM_COASTAL, sm_open=SM_OPEN, workers=1):
+    """Prepare metadata and build the openLCA objects for each process."""
+    from flcac_utils.generate_processes import build_process_dict
+
+    objs = prepare_json(df_olca, tech, data_path, anch_time=anch_time,
+                        origin_maneuv_speed=origin_maneuv_speed,
+                        dest_maneuv_speed=dest_maneuv_speed,
+                        sm_coastal=sm_coastal, sm_open=sm_open)
+    with instrumentation.call('build_process_dict'):
+        processes = build_processes(objs['df_olca'], objs['template'],
+                                    objs['flows'],
+                                    loc_objs=objs['location_objs'],
+                                    source_objs=objs['source_objs'],
+                                    actor_objs=objs['actor_objs'],
+                                    dq_objs=objs['dq_objs'],
+                                    workers=workers)
+        # build bridge processes
+        bridge_processes = build_process_dict(objs['df_bridge'], objs['flows'],
+                                              meta=objs['bridge_meta'])
+
+    return {'flows': objs['flows'], 'new_flows': objs['new_flows'],
+            'processes': processes, 'bridge_processes': bridge_processes,
+            'source_objs': objs['source_objs'],
+            'actor_objs': objs['actor_objs'],
+            'dq_objs': objs['dq_objs'], 'location_objs': objs['location_objs']}
+
+
+def stream_json(df_olca, tech, writer, data_path=data_path, anch_time=ANCH_TIME,
+                origin_maneuv_speed=ORIGIN_MANEUV_SPEED,
+                dest_maneuv_speed=DEST_MANEUV_SPEED,
+                sm_coastal=SM_COASTAL, sm_open=SM_OPEN, workers=1):
+    """
+    Build the processes one at a time and write each to `writer` as it is
+    built, followed by the flows and shared objects. As with write_objects,
+    only the flows of the exchanges of the processes are written, and no
+    bridge processes, as in write_json.
+    :param writer: streaming_export.ZipWriter, TeeWriter or
+        incremental_export.FolderWriter
+    """
+    objs = prepare_json(df_olca, tech, data_path, anch_time=anch_time,
+                        origin_maneuv_speed=origin_maneuv_speed,
+                        dest_maneuv_speed=dest_maneuv_speed,
+                        sm_coastal=sm_coastal, sm_open=sm_open)
+    with instrumentation.call('build_process_dict'):
+        processes = iter_processes(objs['df_olca'], objs['template'],
+                                   objs['flows'],
+                                   loc_objs=objs['location_objs'],
+                                   source_objs=objs['source_objs'],
+                                   actor_objs=objs['actor_objs'],
+                                   dq_objs=objs['dq_objs'],
+                                   workers=workers)
+        flows = referenced_flows(objs['flows'], objs['df_olca']['FlowUUID'])
+        write_stream(writer, processes,
+                     [flows, objs['source_objs'], objs['actor_objs'],
+                      objs['dq_objs'], objs['location_objs']])
 
 #%% Write to json
-out_path = parent_path / 'output'
-write_objects('marine', flows, new_flows, processes,
-              source_objs, actor_objs, dq_objs,
-              location_objs, # bridge_processes,
-              out_path = out_path)
-## ^^ Import this file into an empty database with units and flow properties only
-## or merge into USLCI and overwrite all existing datasets
-
-#%% Unzip files to repo
-from flcac_utils.util import extract_latest_zip
-
-extract_latest_zip(out_path,
-                   parent_path,
-                   output_folder_name = Path('output') / 'marine_v1.0')
+
+def referenced_flows(flows, flow_ids):
+    """Flows of `flows` whose UUID is in `flow_ids`, the flows of the
+    exchanges written, as exported by write_objects."""
+    flow_ids = set(flow_ids)
+    return {k: flow for k, flow in flows.items() if k in flow_ids}
+
+
+def write_json(objs, out_path=out_path, incremental=False):
+    """
+    Write the objects to a JSON-LD zip and extract it to output/marine_v1.0.
+    With `incremental`, only files in output/marine_v1.0 whose content changed
+    are rewritten, and files of objects no longer generated are removed.
+    """
+    if incremental:
+        flows = referenced_flows(
+            objs['flows'], {e.flow.id for p in objs['processes'].values()
+                            for e in p.exchanges})
+        report = export_objects(
+            [objs['processes'], flows, objs['source_objs'],
+             objs['actor_objs'], objs['dq_objs'], objs['location_objs']],
+            out_path / 'marine_v1.0')
+        print_report(report)
+        return report
+
+    from flcac_utils.generate_processes import write_objects
+    from flcac_utils.util import extract_latest_zip
+
+    with instrumentation.call('write_objects'):
+        write_objects('marine', objs['flows'], objs['new_flows'], objs['processes'],
+                      objs['source_objs'], objs['actor_objs'], objs['dq_objs'],
+                      objs['location_objs'], # bridge_processes,
+                      out_path = out_path)
+    ## ^^ Import this file into an empty database with units and flow properties only
+    ## or merge into USLCI and overwrite all existing datasets
+
+    # Unzip files to repo
+    with instrumentation.call('extract_latest_zip'):
+        extract_latest_zip(out_path,
+                           parent_path,
+                           output_folder_name = Path('output') / 'marine_v1.0')
+
+#%% Pipeline
+
+def build_stages(engine='frame', workers=1, compact=None, voyages=None,
+                 voyage_config=None):
+    """
+    Stages of the marine pipeline with the input files and constants that
+    each depends on.
+    :param engine: str, 'frame' to calculate emissions on the cross joined
+        frame, or 'tensor' for the array based calculation that only keeps
+        non-zero emissions
+    :param workers: int, number of processes used to build the process objects
+    :param compact: bool, hold the string dimensions as Categoricals,
+        defaults to compact_dtypes.ENABLED
+    :param voyages: list of voyage files or folders, from which route
+        distances are derived in place of distances.csv (see voyage_ingest)
+    :param voyage_config: path to the YAML config of the voyage columns
+    """
+    compact = compact_dtypes.ENABLED if compact is None else compact
+    maneuv = {'dest_maneuv_speed': DEST_MANEUV_SPEED,
+              'origin_maneuv_speed': ORIGIN_MANEUV_SPEED}
+    timing_files = ['marine_runs.csv', 'hotel_hours.csv', 'hotel_hours_us.csv']
+    timing_upstream = ['engine_power']
+    distance_stages = []
+    if voyages:
+        distance_stages = [
+            Stage('voyage_distances', voyage_ingest.voyage_distances,
+                  # distances.csv fills routes and values without voyages
+                  files=['marine_runs.csv', 'distances.csv'],
+                  external=voyage_ingest.input_files(voyages, voyage_config),
+                  constants={'voyages': [str(Path(v).resolve())
+                                         for v in voyages],
+                             'config': voyage_config},
+                  options={'workers': workers}),
+            ]
+        timing_upstream.append('voyage_distances')
+    else:
+        timing_files.append('distances.csv')
+    ef_files = ['emission_factors.csv', 'flow_speciation.csv',
+                'engine_load_factor.csv']
+    if engine == 'tensor':
+        emission_stages = [
+            Stage('emissions', tensor_emissions, upstream=timing_upstream,
+                  files=timing_files + ef_files,
+                  constants={'anch_time': ANCH_TIME, 'compact': compact,
+                             **maneuv}),
+            ]
+    else:
+        emission_stages = [
+            Stage('leg_timing', leg_timing, upstream=timing_upstream,
+                  files=timing_files,
+                  constants={'anch_time': ANCH_TIME, 'compact': compact,
+                             **maneuv}),
+            Stage('emissions', calculate_emissions, upstream=['leg_timing'],
+                  files=ef_files, constants={'compact': compact}),
+            ]
+    return [
+        Stage('engine_power', engine_power,
+              files=['marine_runs.csv', 'engine_characteristics.csv',
+                     'utilization.csv', 'transit_speed_ratios.csv',
+                     'auxiliary_load.csv', 'boiler_load.csv'],
+              constants={'sm_open': SM_OPEN, 'sm_coastal': SM_COASTAL,
+                         'anch_speed': ANCH_SPEED, **maneuv}),
+        *distance_stages,
+        *emission_stages,
+        Stage('flow_mapping', map_elementary_flows, upstream=['emissions'],
+              files=['Marine_fedefl_flow_mapping.csv'],
+              constants={'nm_to_km': NM_to_KM, 'compact': compact}),
+        Stage('tech_flow_mapping', map_tech_flows,
+              upstream=['flow_mapping', 'emissions'],
+              files=['Marine_fuel_mapping.csv', 'marine_inputs.yaml'],
+              constants={'auth': auth, 'compact': compact}),
+        Stage('dqi', assign_dqi, upstream=['tech_flow_mapping'],
+              files=['marine_inputs.yaml']),
+        Stage('aggregation', aggregate, upstream=['dqi']),
+        Stage('json_build', build_json,
+              upstream=['aggregation', 'tech_flow_mapping'],
+              files=['Marine_process_metadata.yaml', 'transport.bib',
+                     'marine_inputs.yaml'],
+              constants={'anch_time': ANCH_TIME, 'sm_coastal': SM_COASTAL,
+                         'sm_open': SM_OPEN, **maneuv},
+              options={'workers': workers}),
+        ]
+
+
+def run(use_cache=True, data_path=data_path, out_path=out_path, engine='frame',
+        workers=1, incremental=False, voyages=None, voyage_config=None,
+        stream=False, parquet=False):
+    # Snapshots are written as a side effect of the frame based stages
+    recompute = (['leg_timing', 'emissions']
+                 if qa_snapshots.ENABLED and engine == 'frame' else [])
+    pipeline = StagePipeline(build_stages(engine, workers, voyages=voyages,
+                                          voyage_config=voyage_config),
+                             data_path=data_path,
+                             cache_path=cache_path, use_cache=use_cache,
+                             recompute=recompute)
+    if parquet:
+        df_olca = pipeline.get('aggregation')
+        with instrumentation.stage('parquet_export', [df_olca]):
+            path = route_lookup.export(compact_dtypes.decode(df_olca),
+                                       out_path / 'marine_exchanges')
+        print(f'Exchange table written to {path}')
+    if stream:
+        ## processes are written as they are built and never held together,
+        ## so the json_build stage (and its cache) is bypassed
+        df_olca = pipeline.get('aggregation')
+        tech = pipeline.get('tech_flow_mapping')
+        constants = pipeline.stages['json_build'].constants
+        with instrumentation.stage('write'):
+            ## the folder is updated as the zip is written, in place of
+            ## extracting it
+            with FolderWriter(out_path / 'marine_v1.0') as folder:
+                if incremental:
+                    stream_json(df_olca, tech, folder, data_path=data_path,
+                                workers=workers, **constants)
+                else:
+                    with ZipWriter(out_path / 'marine_v1.0.zip') as zw:
+                        stream_json(df_olca, tech, TeeWriter(zw, folder),
+                                    data_path=data_path, workers=workers,
+                                    **constants)
+                    print(f'Written to {zw.path}: ' + ', '.join(
+                        f'{n} {k}' for k, n in zw.counts.items()))
+            print_report(folder.report)
+        return pipeline
+    objs = pipeline.get('json_build')
+    with instrumentation.stage('write'):
+        write_json(objs, out_path=out_path, incremental=incremental)
+    return pipeline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='recompute all stages without reading or '
+                        'writing the stage cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='remove all cached stage outputs before running')
+    parser.add_argument('--engine', choices=['frame', 'tensor'],
+                        default='frame',
+                        help='emissions calculation; tensor uses aligned '
+                        'arrays and omits zero emission rows')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to build the process '
+                        'objects')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only rewrite changed files in output/marine_v1.0 '
+                        'instead of writing and extracting a full zip')
+    parser.add_argument('--profile', nargs='?', const='', default=None,
+                        metavar='REPORT',
+                        help='record time, memory and row counts by stage and '
+                        'write a JSON report (default .cache/profile/'
+                        'marine_profile.json)')
+    parser.add_argument('--qa-snapshots', action='store_true',
+                        help='write the energy and emissions frames to '
+                        '.cache/qa as Parquet for validation')
+    parser.add_argument('--compact', action='store_true',
+                        help='hold repeated string columns as categoricals '
+                        'to reduce memory')
+    parser.add_argument('--offline', action='store_true',
+                        help='serve LCA Commons objects from the local cache '
+                        'or exported JSON-LD, without network requests')
+    parser.add_argument('--refresh-api', action='store_true',
+                        help='invalidate cached LCA Commons objects')
+    parser.add_argument('--voyages', nargs='+', metavar='PATH',
+                        help='voyage CSV or Parquet files or folders, from '
+                        'which route distances are derived in place of '
+                        'distances.csv')
+    parser.add_argument('--voyage-config', metavar='YAML',
+                        help='column names and route lookups of the voyages')
+    parser.add_argument('--stream', action='store_true',
+                        help='write each process as it is built instead of '
+                        'building all processes first (output/marine_v1.0.zip, '
+                        'or output/marine_v1.0 with --incremental)')
+    parser.add_argument('--parquet', action='store_true',
+                        help='also write the aggregated exchanges to '
+                        'output/marine_exchanges as Parquet, partitioned by '
+                        'Ship Type and Fuel')
+    args = parser.parse_args()
+    if args.clear_cache:
+        StagePipeline([], data_path, cache_path).clear()
+    if args.refresh_api:
+        commons_cache.clear()
+    if args.offline:
+        commons_cache.OFFLINE = True
+    if args.qa_snapshots:
+        qa_snapshots.ENABLED = True
+    if args.compact:
+        compact_dtypes.ENABLED = True
+    profile = (args.profile if args.profile is not None
+               else instrumentation.report_path_from_env())
+    if profile is not None:
+        instrumentation.enable()
+    run(use_cache=not args.no_cache, engine=args.engine, workers=args.workers,
+        incremental=args.incremental, voyages=args.voyages,
+        voyage_config=args.voyage_config, stream=args.stream,
+        parquet=args.parquet)
+    if profile is not None:
+        path, report = instrumentation.profiler.write(profile or None)
+        instrumentation.summarize(report)
+        print(f'Profile written to {path}')
@@ -0,0 +1,103 @@
+"""
+Opt-in QA snapshots of intermediate tables. When enabled (`--qa-snapshots`,
+`ENABLED = True` or the environment variable MARINE_QA_SNAPSHOTS=1), the wide
+energy frame and the emissions frame are written to Parquet datasets under
+.cache/qa, partitioned by Ship Type and Fuel, one partition at a time. Nothing
+is held in memory beyond the frame being processed.
+
+Snapshots are read back lazily, e.g. to compare tons against the original EPA
+tool output:
+
+    import qa_snapshots
+    df = qa_snapshots.load('emissions', columns=['Ship Type', 'Fuel', 'tons'],
+                           filters=[('Fuel', '==', 'Residual fuel oil')])
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+snapshot_path = Path(__file__).parent / '.cache' / 'qa'
+
+ENABLED = (os.environ.get('MARINE_QA_SNAPSHOTS', '').lower()
+           in ('1', 'true', 'yes'))
+
+PARTITION_COLS = ['Ship Type', 'Fuel']
+
+
+def save(df, name, partition_cols=PARTITION_COLS, path=None):
+    """
+    Write df to the snapshot dataset `name`, replacing an existing snapshot.
+    Does nothing unless snapshots are enabled.
+    :param partition_cols: list of columns to partition by, None or [] for a
+        single file
+    :return: path to the dataset, None if not written
+    """
+    if not ENABLED:
+        return None
+    return write_dataset(df, Path(path or snapshot_path) / name,
+                         partition_cols)
+
+
+def write_dataset(df, root, partition_cols=PARTITION_COLS):
+    """
+    Write df to a Parquet dataset at root, replacing an existing dataset,
+    with hive partitions of partition_cols written one at a time.
+    :return: root
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    root = Path(root)
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir(parents=True)
+    partition_cols = [c for c in (partition_cols or []) if c in df]
+    if not partition_cols:
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                       root / 'part-0.parquet')
+        return root
+    # Convert one partition at a time to bound the memory of the Arrow copy
+    for _, chunk in df.groupby(partition_cols, sort=False, dropna=False,
+                               observed=True):
+        pq.write_to_dataset(pa.Table.from_pandas(chunk, preserve_index=False),
+                            root, partition_cols=partition_cols)
+    return root
+
+
+def dataset(name, path=None):
+    """Snapshot `name` as a pyarrow dataset, for lazy scanning."""
+    import pyarrow.dataset as ds
+
+    root = Path(path or snapshot_path) / name
+    if not root.exists():
+        raise FileNotFoundError(f'No QA snapshot {name} in {root.parent}, '
+                                'run with --qa-snapshots')
+    return ds.dataset(root, format='parquet', partitioning='hive')
+
+
+def load(name, columns=None, filters=None, path=None):
+    """
+    Read snapshot `name`, only scanning the requested columns and the
+    partitions matching `filters`.
+    :param columns: list of columns, None for all
+    :param filters: list of (column, op, value) tuples as accepted by
+        pandas.read_parquet
+    :return: df
+    """
+    import pyarrow.parquet as pq
+
+    dataset(name, path) # raises if missing
+    table = pq.read_table(Path(path or snapshot_path) / name, columns=columns,
+                          filters=filters, partitioning='hive')
+    return table.to_pandas()
+
+
+def available(path=None):
+    """Names of the snapshots on disk."""
+    root = Path(path or snapshot_path)
+    return sorted(p.name for p in root.iterdir()) if root.exists() else []
+
+
+def clear(path=None):
+    shutil.rmtree(Path(path or snapshot_path), ignore_errors=True)
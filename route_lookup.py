@@ -0,0 +1,188 @@
+"""
+Columnar export of the aggregated exchanges and an indexed route lookup.
+The final exchange table (df_olca after aggregation, one row per process and
+flow, amounts per t*km) is written with `--parquet` to a Parquet dataset in
+output/marine_exchanges, partitioned by Ship Type and Fuel, so that tools can
+read one route's exchanges without parsing the JSON-LD.
+
+RouteIndex loads the table once and indexes it by (Global Region, US Region,
+Ship Type, Fuel, Flow), with Flow the flow name or UUID. A flow name can
+match several exchanges of a route, one per context (e.g. Carbon dioxide to
+emission/air and to emission/air/troposphere/rural); pass a context to keep
+only one of them:
+
+    from route_lookup import RouteIndex
+    index = RouteIndex.load()
+    index.lookup('Asia', 'US Gulf', 'Container Ship', 'Residual fuel oil',
+                 'Carbon dioxide', context='emission/air')
+
+or, as a local HTTP service, where context is an optional parameter,
+
+    python route_lookup.py serve --port 8000
+    curl 'localhost:8000/lookup?global_region=Asia&us_region=US+Gulf&ship_type=Container+Ship&fuel=Residual+fuel+oil&flow=Carbon+dioxide&context=emission/air'
+"""
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import qa_snapshots
+
+table_path = Path(__file__).parent / 'output' / 'marine_exchanges'
+
+ROUTE = ['Global Region', 'US Region', 'Ship Type', 'Fuel']
+PARTITION_COLS = ['Ship Type', 'Fuel']
+# Columns of the table, from the columns of df_olca
+COLUMNS = {'ProcessID': 'ProcessID', 'ProcessName': 'ProcessName',
+           'Global Region': 'Global Region', 'US Region': 'US Region',
+           'Ship Type': 'Ship Type', 'Fuel': 'Fuel', 'Subtype': 'Subtype',
+           'name': 'FlowName', 'FlowUUID': 'FlowUUID', 'Context': 'Context',
+           'FlowType': 'FlowType', 'IsInput': 'IsInput',
+           'reference': 'reference', 'unit': 'unit', 'amount': 'amount'}
+# Query parameters of the HTTP service
+PARAMS = {'global_region': 'Global Region', 'us_region': 'US Region',
+          'ship_type': 'Ship Type', 'fuel': 'Fuel', 'flow': 'Flow'}
+OPTIONAL_PARAMS = {'context': 'Context'}
+
+
+def export(df_olca, path=table_path):
+    """
+    Write the exchanges of df_olca to a Parquet dataset partitioned by Ship
+    Type and Fuel, replacing an existing one.
+    :return: path to the dataset
+    """
+    df = (df_olca[[c for c in COLUMNS if c in df_olca]]
+          .rename(columns=COLUMNS)
+          .astype({'IsInput': bool, 'reference': bool})
+          )
+    return qa_snapshots.write_dataset(df, path, PARTITION_COLS)
+
+
+def load(path=table_path, filters=None):
+    """
+    Read the exchange table, only scanning the partitions matching filters.
+    :param filters: list of (column, op, value) tuples as accepted by
+        pandas.read_parquet
+    :return: df with the partition columns as strings
+    """
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f'No exchange table in {path}, run '
+                                'process_marine.py with --parquet')
+    df = pq.read_table(path, filters=filters, partitioning='hive').to_pandas()
+    return df.astype({c: str for c in PARTITION_COLS})
+
+
+class RouteIndex:
+    """
+    Exchanges of df (see `load`) indexed by route and flow name or UUID. Each
+    key maps to a tuple of exchange records (dicts), built once so that a
+    lookup is a dict access.
+    """
+
+    def __init__(self, df):
+        self.index = {}
+        records = df.drop(columns=ROUTE).to_dict('records')
+        for route, record in zip(df[ROUTE].itertuples(index=False, name=None),
+                                 records):
+            for flow in {record['FlowName'], record['FlowUUID']}:
+                self.index.setdefault(route + (flow,), []).append(record)
+        self.index = {k: tuple(v) for k, v in self.index.items()}
+        self.routes = sorted(set(df[ROUTE].itertuples(index=False, name=None)))
+
+    @classmethod
+    def load(cls, path=table_path):
+        return cls(load(path))
+
+    def lookup(self, global_region, us_region, ship_type, fuel, flow,
+               context=None):
+        """
+        :param flow: str, flow name or UUID
+        :param context: str, flow context, e.g. 'emission/air', None for the
+            exchanges of the flow in all contexts
+        :return: tuple of exchange records of the route and flow, empty if
+            there are none
+        """
+        exchanges = self.index.get(
+            (global_region, us_region, ship_type, fuel, flow), ())
+        if context is not None:
+            exchanges = tuple(r for r in exchanges if r['Context'] == context)
+        return exchanges
+
+
+def _handler(index):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            content = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if url.path == '/routes':
+                self._send(200, [dict(zip(ROUTE, r)) for r in index.routes])
+            elif url.path == '/lookup':
+                missing = [p for p in PARAMS if p not in query]
+                if missing:
+                    self._send(400, {'error': 'missing parameters: '
+                                     + ', '.join(missing)})
+                    return
+                exchanges = index.lookup(*(query[p] for p in PARAMS),
+                                         **{p: query[p] for p in OPTIONAL_PARAMS
+                                            if p in query})
+                self._send(200 if exchanges else 404,
+                           {'exchanges': list(exchanges)})
+            else:
+                self._send(404, {'error': f'unknown path {url.path}'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(index, host='127.0.0.1', port=8000):
+    """Serve GET /lookup and /routes from index until interrupted."""
+    server = ThreadingHTTPServer((host, port), _handler(index))
+    print(f'Serving {len(index.routes)} routes on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=table_path,
+                        help='Parquet dataset written with --parquet')
+    commands = parser.add_subparsers(dest='command', required=True)
+    s = commands.add_parser('serve', help='run the local HTTP service')
+    s.add_argument('--host', default='127.0.0.1')
+    s.add_argument('--port', type=int, default=8000)
+    q = commands.add_parser('lookup', help='print the exchanges of a route')
+    for p in PARAMS:
+        q.add_argument(p)
+    for p in OPTIONAL_PARAMS:
+        q.add_argument(f'--{p}')
+    args = parser.parse_args()
+    index = RouteIndex.load(args.path)
+    if args.command == 'serve':
+        serve(index, args.host, args.port)
+    else:
+        exchanges = index.lookup(*(getattr(args, p) for p in PARAMS),
+                                 **{p: getattr(args, p) for p in OPTIONAL_PARAMS})
+        print(pd.DataFrame(list(exchanges)).to_string(index=False)
+              if exchanges else 'No exchanges found')
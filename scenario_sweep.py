@@ -0,0 +1,312 @@
+"""
+Sweep of the vessel operating assumptions. Each scenario sets some of the
+parameters below, the others keep the values used by process_marine:
+
+    sm_open, sm_coastal, anch_time, anch_speed, dest_maneuv_speed,
+    origin_maneuv_speed, transit_speed_factor (scales the transit speed
+    ratios), utilization_factor (scales the utilization)
+
+Scenarios are read from a CSV (one row per scenario, with an optional name
+column) or a YAML file with a list of `scenarios`, a `grid` of values whose
+combinations are all evaluated, and `base` values applied to both:
+
+    base: {anch_time: 0.05}
+    grid:
+      sm_open: [1.1, 1.15, 1.2]
+      transit_speed_factor: [0.9, 1.0]
+    scenarios:
+      - name: slow steaming
+        transit_speed_factor: 0.8
+
+Emission factors, speciation and the mapping of pollutants to FEDEFL and of
+fuels to technosphere flows do not depend on these parameters and are
+compiled once into a weight array[pollutant, zone, leg, flow], and the input
+tables are read once and passed to the workers. Only the speed, power and
+time by leg are evaluated per scenario, across a process pool with
+--workers. The result is a tidy table of the amount of each flow
+per t*km, by scenario and route, in the units of the published processes.
+
+    python scenario_sweep.py scenarios.yaml --workers 4
+"""
+
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import flow_crosswalk
+import process_marine as pm
+import tensor_engine
+
+PARAMETERS = {'sm_open': pm.SM_OPEN,
+              'sm_coastal': pm.SM_COASTAL,
+              'anch_time': pm.ANCH_TIME,
+              'anch_speed': pm.ANCH_SPEED,
+              'dest_maneuv_speed': pm.DEST_MANEUV_SPEED,
+              'origin_maneuv_speed': pm.ORIGIN_MANEUV_SPEED,
+              'transit_speed_factor': 1.0,
+              'utilization_factor': 1.0,
+              }
+
+ROUTE = ['US Region', 'Global Region', 'Fuel', 'Ship Type', 'Subtype']
+FLOW = ['FlowName', 'FlowUUID', 'Context', 'Unit', 'FlowType']
+# Inputs of pm.engine_power and pm.run_timing
+INPUT_FILES = ['marine_runs.csv', 'engine_characteristics.csv',
+               'utilization.csv', 'transit_speed_ratios.csv',
+               'auxiliary_load.csv', 'boiler_load.csv', 'distances.csv',
+               'hotel_hours.csv', 'hotel_hours_us.csv']
+
+
+def _name(row, given):
+    if isinstance(given, str) and given:
+        return given
+    changed = [f'{k}={row[k]:g}' for k in PARAMETERS
+               if row[k] != PARAMETERS[k]]
+    return ','.join(changed) or 'baseline'
+
+
+def load_scenarios(path):
+    """
+    :param path: CSV or YAML file of scenarios
+    :return: df with a name column and a column per PARAMETERS, one row per
+        scenario
+    """
+    path = Path(path)
+    if path.suffix in ('.yaml', '.yml'):
+        with open(path) as f:
+            spec = yaml.safe_load(f) or {}
+        rows = [dict(r) for r in spec.get('scenarios', [])]
+        grid = spec.get('grid', {})
+        if grid:
+            keys = list(grid)
+            rows += [dict(zip(keys, values)) for values in itertools.product(
+                *[np.atleast_1d(grid[k]).tolist() for k in keys])]
+        rows = [{**spec.get('base', {}), **r} for r in rows]
+        df = pd.DataFrame(rows)
+    elif path.suffix == '.csv':
+        df = pd.read_csv(path)
+    else:
+        raise ValueError(f'{path.name}: scenarios must be a CSV or YAML file')
+    unknown = [c for c in df if c not in PARAMETERS and c != 'name']
+    if unknown:
+        raise ValueError(f'Unknown scenario parameters: {", ".join(unknown)}')
+    if df.empty:
+        raise ValueError(f'{path.name} defines no scenarios')
+    df = (df.reindex(columns=['name'] + list(PARAMETERS))
+          .fillna({k: v for k, v in PARAMETERS.items()})
+          .astype({k: float for k in PARAMETERS})
+          )
+    df['name'] = [_name(row, row['name']) for _, row in df.iterrows()]
+    dups = df['name'][df['name'].duplicated()]
+    if len(dups):
+        raise ValueError(f'Duplicate scenarios: {", ".join(dups.unique())}')
+    return df.reset_index(drop=True)
+
+
+def load_inputs(data_path=pm.data_path):
+    """Input frames of the speed, power and timing, read once for all
+    scenarios."""
+    return {name: pd.read_csv(data_path / name) for name in INPUT_FILES}
+
+
+def _timing(data_path, params, inputs=None):
+    speeds = pm.engine_power(
+        data_path, sm_open=params['sm_open'], sm_coastal=params['sm_coastal'],
+        anch_speed=params['anch_speed'],
+        dest_maneuv_speed=params['dest_maneuv_speed'],
+        origin_maneuv_speed=params['origin_maneuv_speed'],
+        transit_speed_factor=params['transit_speed_factor'], inputs=inputs)
+    runs = pm.run_timing(speeds, data_path, anch_time=params['anch_time'],
+                         dest_maneuv_speed=params['dest_maneuv_speed'],
+                         origin_maneuv_speed=params['origin_maneuv_speed'],
+                         inputs=inputs)
+    return speeds, runs
+
+
+def flow_weights(pollutants, data_path=pm.data_path, by_description=False):
+    """
+    Weights that take emissions in kg by pollutant, zone and leg to the flows
+    of the processes: FEDEFL flows in g and the fuel input in kg.
+    Pollutants without a FEDEFL flow are dropped, as in the pipeline.
+    :param pollutants: df, the pollutant axis of tensor_engine.factor_arrays
+    :param by_description: bool, keep flows of ECA and nonECA pollutants
+        apart, as separate exchanges of the processes
+    :return: weights[pollutant, zone, leg, flow], df of flows (FLOW columns,
+        and description if by_description; the fuel input has FlowName None
+        and is named by the route's fuel)
+    """
+    marine_inputs = pm.load_marine_inputs(data_path)
+    index = flow_crosswalk.compile_index(data_path /
+                                         'Marine_fedefl_flow_mapping.csv')
+    p, z, l = np.meshgrid(np.arange(len(pollutants)), np.arange(len(pm.zones)),
+                          np.arange(len(pm.legs)), indexing='ij')
+    keys = pd.MultiIndex.from_arrays([
+        pollutants['Name'].to_numpy()[p.ravel()],
+        [f'{pm.zones[i]}/{pm.legs[j]}' for i, j in zip(z.ravel(), l.ravel())],
+        np.repeat('kg', p.size)])
+    targets = index.reindex(keys).reset_index(drop=True)
+    targets = targets.assign(
+        FlowType = np.where(targets['TargetFlowUUID'].notna(),
+                            'ELEMENTARY_FLOW', None),
+        TargetUnit = np.where(targets['TargetFlowUUID'].notna(), 'g', None),
+        ConversionFactor = targets['ConversionFactor'] * 1000) # kg to g
+    fuel = keys.get_level_values(0) == marine_inputs['EnergyFlow']
+    targets.loc[fuel, ['TargetFlowUUID', 'TargetFlowContext', 'TargetUnit',
+                       'ConversionFactor', 'FlowType']] = [
+        'fuel', marine_inputs['FlowContext'], 'kg', 1, 'PRODUCT_FLOW']
+    targets.loc[fuel, 'TargetFlowName'] = None
+    targets['description'] = pollutants['description'].to_numpy()[p.ravel()]
+
+    flow_key = targets['TargetFlowUUID']
+    if by_description:
+        flow_key = flow_key + '/' + targets['description']
+    flow_idx, uuids = pd.factorize(flow_key, sort=True)
+    mapped = flow_idx >= 0
+    codes, first = np.unique(flow_idx, return_index=True)
+    flows = (targets.iloc[first[codes >= 0]]
+             .rename(columns={'TargetFlowName': 'FlowName',
+                              'TargetFlowUUID': 'FlowUUID',
+                              'TargetFlowContext': 'Context',
+                              'TargetUnit': 'Unit'})
+             [FLOW + (['description'] if by_description else [])]
+             .assign(FlowUUID = lambda x: x['FlowUUID'].mask(
+                 x['FlowType'] == 'PRODUCT_FLOW'))
+             .reset_index(drop=True)
+             )
+    weights = np.zeros(p.shape + (len(uuids),))
+    weights.reshape(-1, len(uuids))[np.flatnonzero(mapped), flow_idx[mapped]] = (
+        targets['ConversionFactor'].to_numpy(dtype=float)[mapped])
+    return weights, flows
+
+
+def _route_keys(run_attrs):
+    return pd.MultiIndex.from_frame(run_attrs[ROUTE].astype(object))
+
+
+def prepare(data_path=pm.data_path):
+    """
+    Compile the parameter independent inputs of the sweep: the input frames,
+    routes, emission factors by route and the flow weights.
+    :return: dict
+    """
+    inputs = load_inputs(data_path)
+    speeds, runs = _timing(data_path, PARAMETERS, inputs)
+    run_attrs, _, _, _ = tensor_engine.run_arrays(runs, speeds, pm.legs,
+                                                  pm.engines, pm.zones)
+    emissions = pm.load_emission_factors(data_path)
+    fuels = run_attrs['Fuel'].unique()
+    pollutants, ef, zone_mask, _ = tensor_engine.factor_arrays(
+        emissions, fuels, pm.legs, pm.engines, pm.zones)
+    weights, flows = flow_weights(pollutants, data_path)
+    # kg by kWh; missing factors do not contribute, as in the pipeline
+    ef_run = np.nan_to_num(
+        ef[:, pd.Index(fuels).get_indexer(run_attrs['Fuel']), :]
+        .transpose(1, 0, 2)) / 1000 # [run, engine, pollutant]
+    weights = weights * zone_mask[:, :, None, None]
+    fuel_names = (pd.read_csv(data_path / 'Marine_fuel_mapping.csv')
+                  .set_index('SourceFlowName')['TargetFlowName'])
+    return {'data_path': data_path,
+            'inputs': inputs,
+            'routes': run_attrs[ROUTE].astype(object),
+            'ef_run': ef_run,
+            'weights': weights,
+            'flows': flows,
+            'fuel_names': fuel_names,
+            }
+
+
+_shared = {}
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def evaluate(params):
+    """
+    Amount of each flow per t*km by route for one scenario.
+    :param params: dict of PARAMETERS
+    :return: array[route, flow]
+    """
+    speeds, runs = _timing(_shared['data_path'], params, _shared['inputs'])
+    run_attrs, time, power, vessel_idx = tensor_engine.run_arrays(
+        runs, speeds, pm.legs, pm.engines, pm.zones)
+    if not _route_keys(run_attrs).equals(_route_keys(_shared['routes'])):
+        raise ValueError('Routes differ from those of the baseline')
+    # energy[run, zone, leg, engine], missing power is treated as zero
+    energy = np.nan_to_num(time[:, :, :, None] * power[:, None].transpose(0, 1, 3, 2))
+    amounts = np.einsum('rzle,rep,pzlf->rf', energy, _shared['ef_run'],
+                        _shared['weights'], optimize=True)
+    main = vessel_idx[:, pm.engines.index('Main')]
+    capacity = speeds['Capacity (metric tons)'].to_numpy(dtype=float)[main]
+    utilization = speeds['Utilization'].to_numpy(dtype=float)[main]
+    utilization = np.where(np.isnan(utilization), 1, utilization)
+    tkm = (run_attrs['AvgOfDistance (nm)'].to_numpy(dtype=float) * pm.NM_to_KM
+           * capacity * utilization * params['utilization_factor'])
+    return amounts / tkm[:, None]
+
+
+def sweep(scenarios, data_path=pm.data_path, workers=1):
+    """
+    :param scenarios: df as returned by load_scenarios
+    :param workers: int, number of worker processes, 1 to evaluate serially
+    :return: tidy df, one row per scenario, route and flow with the scenario
+        parameters and FlowAmount per t*km. Flows that are zero for a route
+        in all scenarios are omitted
+    """
+    shared = prepare(data_path)
+    params = scenarios[list(PARAMETERS)].to_dict('records')
+    if workers <= 1:
+        _init_worker(shared)
+        results = [evaluate(p) for p in params]
+        _shared.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(shared,)) as executor:
+            results = list(executor.map(evaluate, params))
+    amounts = np.stack(results) # [scenario, route, flow]
+
+    routes, flows = shared['routes'], shared['flows']
+    r, f = np.nonzero((amounts != 0).any(axis=0))
+    n = len(scenarios)
+    df = pd.concat([
+        scenarios.rename(columns={'name': 'scenario'})
+        .iloc[np.repeat(np.arange(n), len(r))].reset_index(drop=True),
+        routes.iloc[np.tile(r, n)].reset_index(drop=True),
+        flows.iloc[np.tile(f, n)].reset_index(drop=True),
+        ], axis=1)
+    df['FlowName'] = df['FlowName'].fillna(df['Fuel'].map(shared['fuel_names']))
+    df['FlowAmount'] = amounts[:, r, f].ravel()
+    return df
+
+
+def write(df, out_path):
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    if out_path.suffix == '.parquet':
+        df.to_parquet(out_path, index=False)
+    else:
+        df.to_csv(out_path, index=False)
+    return out_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', help='CSV or YAML file of scenarios')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes evaluating scenarios')
+    parser.add_argument('--output', default=None,
+                        help='results file, .csv or .parquet (default '
+                        '<scenarios>_results.csv next to the scenarios file)')
+    args = parser.parse_args()
+    scenarios = load_scenarios(args.scenarios)
+    output = (args.output or Path(args.scenarios).with_name(
+        f'{Path(args.scenarios).stem}_results.csv'))
+    df = sweep(scenarios, workers=args.workers)
+    path = write(df, output)
+    print(f'{len(scenarios)} scenarios, {len(df)} rows written to {path}')
@@ -0,0 +1,196 @@
+"""
+Content-hash caching of pipeline stages. Each stage output is stored on disk
+keyed by a hash of its input files, constants, code and the keys of its
+upstream stages, so that a rebuild only recomputes the stages downstream of
+what changed. The code of a stage is the source of the module defining it and
+of the local modules that module uses (directly or through other local
+modules), so that changes to helpers, module constants or e.g. aggregation.py
+are not served from a stale cache.
+"""
+
+import hashlib
+import inspect
+import json
+import pickle
+import shutil
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+import instrumentation
+
+
+@dataclass
+class Stage:
+    """
+    A named pipeline step. `func` is called with the outputs of the
+    `upstream` stages as positional arguments, followed by `data_path` and
+    the `constants` as keyword arguments. `files` are relative to the data
+    path and are hashed as inputs of the stage. `external` are paths of
+    inputs outside the data path that may be too large to hash (e.g. voyage
+    records); they are identified by size and modification time. `options`
+    are passed like constants but are not part of the cache key, for
+    settings that do not change the result (e.g. number of workers).
+    """
+    name: str
+    func: Callable
+    upstream: list = field(default_factory=list)
+    files: list = field(default_factory=list)
+    constants: dict = field(default_factory=dict)
+    options: dict = field(default_factory=dict)
+    external: list = field(default_factory=list)
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _local_modules(module, root, found):
+    """Add module and the modules under root it references to found."""
+    found[module.__name__] = Path(module.__file__)
+    for value in vars(module).values():
+        m = (value if inspect.ismodule(value)
+             else sys.modules.get(getattr(value, '__module__', None) or ''))
+        file = getattr(m, '__file__', None)
+        if (file is None or m.__name__ in found
+                or Path(file).resolve().parent != root):
+            continue
+        _local_modules(m, root, found)
+    return found
+
+
+def code_hash(func):
+    """
+    Hash of the source of the module defining func and of the local modules
+    (in the same folder) it references, transitively.
+    """
+    module = inspect.getmodule(func)
+    root = Path(module.__file__).resolve().parent
+    h = hashlib.sha256()
+    for name, path in sorted(_local_modules(module, root, {}).items()):
+        h.update(name.encode())
+        h.update(hash_file(path).encode())
+    return h.hexdigest()
+
+
+def file_signature(path):
+    stat = Path(path).stat()
+    return f'{Path(path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def _write_frame(df, path):
+    """Write df to parquet, returns False if parquet is not available or the
+    frame can not be represented (e.g. mixed type object columns)."""
+    try:
+        df.to_parquet(path)
+    except (ImportError, ValueError, TypeError, NotImplementedError):
+        path.unlink(missing_ok=True)
+        return False
+    return True
+
+
+class StagePipeline:
+    """
+    Resolves stage outputs on demand. Stage keys are computed from inputs
+    only, so a cached stage is loaded without touching its upstream stages.
+    """
+
+    def __init__(self, stages, data_path, cache_path, use_cache=True,
+                 recompute=()):
+        """
+        :param recompute: stage names that are computed (and stored) even if
+            cached, e.g. for their side effects
+        """
+        self.stages = {s.name: s for s in stages}
+        self.data_path = Path(data_path)
+        self.cache_path = Path(cache_path)
+        self.use_cache = use_cache
+        self.recompute = set(recompute)
+        self._keys = {}
+        self._code = {}
+        self._results = {}
+
+    def key(self, name):
+        if name not in self._keys:
+            stage = self.stages[name]
+            h = hashlib.sha256()
+            h.update(name.encode())
+            module = inspect.getmodule(stage.func).__name__
+            if module not in self._code:
+                self._code[module] = code_hash(stage.func)
+            h.update(self._code[module].encode())
+            for f in stage.files:
+                h.update(f.encode())
+                h.update(hash_file(self.data_path / f).encode())
+            for f in stage.external:
+                h.update(file_signature(f).encode())
+            h.update(json.dumps(stage.constants, sort_keys=True,
+                                default=str).encode())
+            for u in stage.upstream:
+                h.update(self.key(u).encode())
+            self._keys[name] = h.hexdigest()
+        return self._keys[name]
+
+    def _stage_dir(self, name):
+        return self.cache_path / name / self.key(name)[:16]
+
+    def is_cached(self, name):
+        return (self._stage_dir(name) / 'complete').exists()
+
+    def _load(self, name):
+        path = self._stage_dir(name)
+        items = {}
+        for f in sorted(path.iterdir()):
+            if f.suffix == '.parquet':
+                items[f.stem] = pd.read_parquet(f)
+            elif f.suffix == '.pkl':
+                with open(f, 'rb') as fp:
+                    items[f.stem] = pickle.load(fp)
+        return items.get('__result__', items)
+
+    def _store(self, name, result):
+        path = self._stage_dir(name)
+        # Only keep the latest version of each stage
+        if path.parent.exists():
+            shutil.rmtree(path.parent)
+        path.mkdir(parents=True)
+        items = result if isinstance(result, dict) else {'__result__': result}
+        for k, v in items.items():
+            if isinstance(v, pd.DataFrame) and _write_frame(
+                    v, path / f'{k}.parquet'):
+                continue
+            with open(path / f'{k}.pkl', 'wb') as fp:
+                pickle.dump(v, fp)
+        (path / 'complete').touch()
+
+    def get(self, name):
+        """Return the output of stage `name`, from cache where possible."""
+        if name in self._results:
+            return self._results[name]
+        result = None
+        if (self.use_cache and name not in self.recompute
+                and self.is_cached(name)):
+            with instrumentation.stage(name, source='cache') as rec:
+                result = self._load(name)
+                rec.output(result)
+        if result is None:
+            stage = self.stages[name]
+            args = [self.get(u) for u in stage.upstream]
+            with instrumentation.stage(name, inputs=args) as rec:
+                result = stage.func(*args, data_path=self.data_path,
+                                    **stage.constants, **stage.options)
+                rec.output(result)
+            if self.use_cache:
+                self._store(name, result)
+        self._results[name] = result
+        return result
+
+    def clear(self):
+        shutil.rmtree(self.cache_path, ignore_errors=True)
@@ -0,0 +1,124 @@
+"""
+Streaming export of the openLCA objects. Processes are written to the
+JSON-LD zip (or folder, see incremental_export.FolderWriter) as they are
+built and released, followed by the flows and other shared objects, each
+written once. Peak memory is then bounded by the exchange table and the
+shared objects rather than by the number of processes.
+
+The entries of two JSON-LD zips, e.g. a streamed archive and one written by
+flcac_utils' write_objects, are compared with
+
+    python streaming_export.py output/marine_v1.0.zip <reference>.zip
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+from incremental_export import FOLDERS
+
+
+class ZipWriter:
+    """
+    Writes objects one at a time to an openLCA JSON-LD zip, with the entries
+    written by olca_schema.zipio.ZipWriter. Objects with an id that was
+    already written are skipped. The zip is written to a temporary file and
+    replaces `path` on close.
+    """
+
+    def __init__(self, path):
+        from olca_schema import zipio
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp = self.path.with_suffix('.tmp')
+        self.tmp.unlink(missing_ok=True)
+        self.zip = zipio.ZipWriter(self.tmp)
+        self.written = set()
+        self.counts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.zip.close()
+            self.tmp.unlink(missing_ok=True)
+
+    def write(self, obj):
+        folder = FOLDERS[type(obj).__name__]
+        if (folder, obj.id) in self.written:
+            return
+        self.written.add((folder, obj.id))
+        self.zip.write(obj)
+        self.counts[folder] = self.counts.get(folder, 0) + 1
+
+    def close(self):
+        """:return: dict of the number of objects written by folder"""
+        self.zip.close()
+        os.replace(self.tmp, self.path)
+        return self.counts
+
+
+class TeeWriter:
+    """Writes each object to all of `writers`, e.g. a ZipWriter and a
+    FolderWriter keeping the extracted folder in step with the zip."""
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def write(self, obj):
+        for w in self.writers:
+            w.write(obj)
+
+
+def write_stream(writer, processes, shared):
+    """
+    :param writer: ZipWriter or incremental_export.FolderWriter
+    :param processes: iterable of (key, process object), e.g. from
+        process_builder.iter_processes
+    :param shared: iterable of dicts or lists of objects written after the
+        processes (flows, sources, actors, ...)
+    """
+    for _, process in processes:
+        writer.write(process)
+    for group in shared:
+        for obj in (group.values() if isinstance(group, dict) else group):
+            writer.write(obj)
+
+
+def _entries(path):
+    with zipfile.ZipFile(path) as z:
+        return {n: hashlib.sha256(z.read(n)).hexdigest() for n in z.namelist()
+                if n.split('/')[0] in FOLDERS.values()}
+
+
+def compare_archives(path, reference):
+    """
+    Compare the object entries of two JSON-LD zips.
+    :return: dict of sorted lists of entries 'missing' from path, 'extra' in
+        path and 'changed' between them
+    """
+    entries, ref = _entries(path), _entries(reference)
+    return {'missing': sorted(ref.keys() - entries.keys()),
+            'extra': sorted(entries.keys() - ref.keys()),
+            'changed': sorted(k for k in entries.keys() & ref.keys()
+                              if entries[k] != ref[k])}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('archive', help='JSON-LD zip to check')
+    parser.add_argument('reference', help='JSON-LD zip to compare to')
+    args = parser.parse_args()
+    diff = compare_archives(args.archive, args.reference)
+    for k, names in diff.items():
+        print(f'{len(names)} {k}')
+        for n in names:
+            print(f'  {n}')
+    sys.exit(1 if any(diff.values()) else 0)
@@ -0,0 +1,171 @@
+"""
+Array based calculation of energy use and emissions. Rather than cross joining
+runs with zones, legs, engines and emission factors, inputs are held as
+aligned arrays
+
+    time[run, zone, leg], power[run, engine, leg],
+    EF[engine, fuel, pollutant], zone mask[pollutant, zone], ELF[pollutant, leg]
+
+and FlowTotal is evaluated by broadcasting over blocks of runs, emitting only
+the long-format rows that are needed. Rows are returned in the same order and
+with the same columns as the frame based calculation.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _positions(labels, values):
+    """Position of each of `values` in `labels`, -1 where not found."""
+    return pd.Index(labels).get_indexer(values)
+
+
+def _pollutant_axis(emissions):
+    """
+    Unique emission factor entries. Speciated pollutants retain the pollutant
+    they were derived from (Source), so that e.g. species of both
+    'PM25 ECA' and 'PM25 nonECA' are kept as separate entries.
+    """
+    keys = (emissions
+            .filter(['Pollutant', 'Source', 'em_flag', 'ELF'])
+            .drop_duplicates(['Pollutant', 'Source'])
+            .reset_index(drop=True)
+            .assign(description = lambda x:
+                    np.select([x['Pollutant'].str.contains(' ECA'),
+                               x['Pollutant'].str.contains('nonECA')],
+                              ['ECA', 'nonECA'], default=''))
+            .assign(Name = lambda x: x['Pollutant']
+                    .str.replace(r'(ECA|nonECA)', '', regex=True).str.strip())
+            )
+    return keys
+
+
+def run_arrays(runs, speeds, legs, engines, zones):
+    """
+    Run attributes and aligned time and power arrays.
+    :return: run_attrs df (one row per run), time[run, zone, leg],
+        power[run, engine, leg] (NaN for engines a vessel does not have) and
+        vessel_idx[run, engine], the row of speeds for each run and engine
+        (-1 if missing)
+    """
+    n_zones = len(zones)
+    n_runs = len(runs) // n_zones
+    zone_idx = _positions(zones, runs['Zone'].iloc[:n_zones])
+    if len(runs) % n_zones or (zone_idx != np.arange(n_zones)).any():
+        raise ValueError('runs must have one row per zone, in order of zones')
+    run_attrs = (runs.iloc[::n_zones]
+                 .drop(columns=runs.filter(
+                     regex=('^.*?(speed|Speed|load|time|Time|Draft|draft|'
+                            'power|AvgPctECA|Maneuv_Dist).*?')).columns)
+                 .reset_index(drop=True))
+    time = (runs[[f'{l}_time' for l in legs]].to_numpy(dtype=float)
+            .reshape(n_runs, n_zones, len(legs)))
+
+    # Engine rows of each run
+    vessel_keys = pd.MultiIndex.from_frame(
+        speeds[['Ship Type', 'Subtype', 'Engine']])
+    run_keys = run_attrs[['Ship Type', 'Subtype']].to_numpy()
+    vessel_idx = np.stack(
+        [vessel_keys.get_indexer(pd.MultiIndex.from_arrays(
+            [run_keys[:, 0], run_keys[:, 1], np.repeat(e, n_runs)]))
+         for e in engines], axis=1) # [run, engine]
+    power_table = np.vstack([
+        speeds[[f'{l}_power' for l in legs]].to_numpy(dtype=float),
+        np.full((1, len(legs)), np.nan)]) # row -1 for missing engines
+    power = power_table[vessel_idx] # [run, engine, leg]
+    return run_attrs, time, power, vessel_idx
+
+
+def factor_arrays(emissions, fuels, legs, engines, zones, apply_elf=False):
+    """
+    Aligned emission factor arrays.
+    :return: pollutants df (see _pollutant_axis), ef[engine, fuel, pollutant]
+        (NaN where there is no factor), zone_mask[pollutant, zone] and
+        elf[pollutant, leg]
+    """
+    pollutants = _pollutant_axis(emissions)
+    ef = np.full((len(engines), len(fuels), len(pollutants)), np.nan)
+    e = _positions(engines, emissions['Engine'])
+    f = _positions(fuels, emissions['Fuel'])
+    p = pd.MultiIndex.from_frame(pollutants[['Pollutant', 'Source']]).get_indexer(
+        pd.MultiIndex.from_frame(emissions[['Pollutant', 'Source']]))
+    keep = (e >= 0) & (f >= 0)
+    ef[e[keep], f[keep], p[keep]] = emissions['EF'].to_numpy(dtype=float)[keep]
+    zone_mask = np.stack([(pollutants['description'] == '')
+                          | (pollutants['description'] == z)
+                          for z in zones], axis=1) # [pollutant, zone]
+    elf = np.ones((len(pollutants), len(legs)))
+    if apply_elf:
+        low_load = np.isin(legs, ['Anchorage', 'Maneuvering'])
+        elf[:, low_load] = pollutants[['ELF']].to_numpy(dtype=float)
+    return pollutants, ef, zone_mask, elf
+
+
+def emissions_by_leg(runs, speeds, emissions, legs, engines, zones,
+                     chunk_size=2000, drop_zeros=True, apply_elf=False):
+    """
+    Energy use and emissions by run, zone, leg, engine and pollutant.
+
+    :param runs: df, one row per run and zone (run major, zones in the order of
+        `zones`) with a {leg}_time column per leg, as returned by run_timing
+    :param speeds: df, one row per Ship Type, Subtype and Engine with a
+        {leg}_power column per leg
+    :param emissions: df of EF by Engine, Fuel and Pollutant with em_flag, ELF
+        and Source (the unspeciated pollutant)
+    :param chunk_size: int, number of runs evaluated per block, bounds memory
+    :param drop_zeros: bool, omit rows where FlowTotal is zero. When False the
+        rows match those of the frame based calculation
+    :param apply_elf: bool, scale Anchorage and Maneuvering emissions by the
+        low load adjustment factor. The frame based calculation does not
+        apply the ELF
+    :return: df in long format
+    """
+    n_runs = len(runs) // len(zones)
+    run_attrs, time, power, vessel_idx = run_arrays(runs, speeds, legs,
+                                                    engines, zones)
+    vessel_cols = ['Capacity (metric tons)', 'Utilization']
+    vessel_table = pd.concat([speeds[vessel_cols],
+                              pd.DataFrame(np.nan, index=[0], columns=vessel_cols)],
+                             ignore_index=True)
+
+    # Emission factors
+    fuels = run_attrs['Fuel'].unique()
+    pollutants, ef, zone_mask, elf = factor_arrays(emissions, fuels, legs,
+                                                   engines, zones, apply_elf)
+    run_fuel = _positions(fuels, run_attrs['Fuel'])
+
+    contexts = np.array([[f'{z}/{l}' for l in legs] for z in zones], dtype=object)
+    labels = {'Zone': np.array(zones, dtype=object),
+              'Leg': np.array(legs, dtype=object),
+              'Engine': np.array(engines, dtype=object)}
+    frames = []
+    for start in range(0, n_runs, chunk_size):
+        stop = min(start + chunk_size, n_runs)
+        # energy[run, zone, leg, engine], missing power is treated as zero
+        energy = np.nan_to_num(time[start:stop, :, :, None]
+                               * power[start:stop, None].transpose(0, 1, 3, 2))
+        ef_run = ef[:, run_fuel[start:stop], :].transpose(1, 0, 2) # [run, engine, pollutant]
+        flow = np.einsum('rzle,rep,pz,pl->rzlep', energy, np.nan_to_num(ef_run),
+                         zone_mask, elf) / 1000
+        mask = np.broadcast_to(~np.isnan(ef_run)[:, None, None, :, :]
+                               & zone_mask.T[None, :, None, None, :],
+                               flow.shape)
+        if drop_zeros:
+            mask = mask & (flow != 0)
+        r, z, l, eng, pol = np.nonzero(mask)
+        chunk = run_attrs.iloc[start + r].reset_index(drop=True)
+        chunk['Zone'] = labels['Zone'][z]
+        chunk['Leg'] = labels['Leg'][l]
+        chunk['Engine'] = labels['Engine'][eng]
+        vessels = vessel_table.iloc[vessel_idx[start + r, eng]].reset_index(drop=True)
+        chunk[vessel_cols] = vessels[vessel_cols].to_numpy()
+        chunk['Pollutant'] = pollutants['Name'].to_numpy()[pol]
+        chunk['em_flag'] = pollutants['em_flag'].to_numpy()[pol]
+        chunk['description'] = pollutants['description'].to_numpy()[pol]
+        chunk['Energy'] = energy[r, z, l, eng]
+        chunk['FlowTotal'] = flow[r, z, l, eng, pol]
+        chunk['Unit'] = 'kg'
+        chunk['tons'] = chunk['FlowTotal'] * .00110231
+        chunk['Context'] = contexts[z, l]
+        frames.append(chunk)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,39 @@
+"""
+The tests run offline: LCA Commons objects are read from the committed export
+in output/marine_v1.0 (see commons_cache), and the stage, object and UUID
+caches are kept in a temporary directory.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+import commons_cache
+import process_marine as pm
+import uuid_cache
+from stage_cache import StagePipeline
+
+
+@pytest.fixture(scope='session', autouse=True)
+def offline(tmp_path_factory):
+    cache = tmp_path_factory.mktemp('cache')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(commons_cache, 'OFFLINE', True)
+        mp.setattr(commons_cache, 'cache_path', cache / 'commons')
+        mp.setattr(uuid_cache, 'cache_path', cache / 'uuids' / 'make_uuid.pkl')
+        yield
+
+
+def make_pipeline(path, engine='frame', workers=1):
+    return StagePipeline(pm.build_stages(engine, workers),
+                         data_path=pm.data_path, cache_path=path,
+                         use_cache=False)
+
+
+@pytest.fixture(scope='session')
+def pipeline(tmp_path_factory):
+    """Frame pipeline, stage results are kept for the session."""
+    return make_pipeline(tmp_path_factory.mktemp('stages'))
@@ -0,0 +1,115 @@
+"""
+Vectorized replacements checked against the row by row logic they replace.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dqi
+import process_marine as pm
+import uuid_cache
+from aggregation import aggregate_exchanges, round_sig_figs
+
+
+def speciate_loop(emissions, speciation_df):
+    """Speciation as previously done in process_marine.py."""
+    pollutant_mapping = {}
+    for basis in speciation_df['Basis'].unique():
+        if basis == 'PM2.5':
+            pollutant_mapping[basis] = ['PM25 ECA', 'PM25 nonECA']
+        else:
+            pollutant_mapping[basis] = [basis]
+    new_rows = []
+    for _, emission_row in emissions.iterrows():
+        pollutant = emission_row['Pollutant']
+        for _, spec_row in speciation_df.iterrows():
+            basis = spec_row['Basis']
+            if pollutant in pollutant_mapping.get(basis, []):
+                new_row = emission_row.copy()
+                new_row['Pollutant'] = spec_row['Pollutant']
+                new_row['EF'] = emission_row['EF'] * spec_row['Fraction']
+                new_row['em_flag'] = 'secondary'
+                new_rows.append(new_row)
+    return pd.concat([emissions, pd.DataFrame(new_rows)], ignore_index=True)
+
+
+def round_to_sig_figs(x, sig_figs):
+    """As flcac_utils.util.round_to_sig_figs."""
+    if x == 0:
+        return 0
+    return round(x, sig_figs - int(math.floor(math.log10(abs(x)))) - 1)
+
+
+def test_speciation():
+    emissions = (pd.read_csv(pm.data_path / 'emission_factors.csv')
+                 .melt(id_vars=['Engine', 'Fuel'], var_name='Pollutant',
+                       value_name='EF')
+                 .assign(em_flag='primary')
+                 .assign(Source=lambda x: x['Pollutant'])
+                 )
+    speciation_df = pd.read_csv(pm.data_path / 'flow_speciation.csv')
+    pd.testing.assert_frame_equal(
+        pm.speciate_emissions(emissions, speciation_df),
+        speciate_loop(emissions, speciation_df), check_dtype=False)
+
+
+def test_round_sig_figs():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([
+        rng.lognormal(0, 10, 20000) * rng.choice([-1, 1], 20000),
+        # ties and values at powers of ten
+        [0, 0.12345, 1.2345e-7, 2.5e-5, 99995, 0.001, 1000, -0.5, 1e300,
+         5e-324, np.nan, np.inf],
+        ])
+    expected = np.array([v if not np.isfinite(v) else round_to_sig_figs(v, 4)
+                         for v in values.tolist()])
+    np.testing.assert_array_equal(round_sig_figs(values, 4), expected)
+
+
+def test_aggregate_exchanges(pipeline):
+    df = pipeline.get('flow_mapping').drop(columns=['Engine', 'Leg', 'Zone'])
+    sum_cols = ['Energy', 'FlowTotal', 'tons', 'FlowAmount']
+    expected = (df.groupby([c for c in df if c not in sum_cols], dropna=False)
+                .agg('sum').reset_index())
+    result = aggregate_exchanges(
+        df, sum_cols, validate=True,
+        carry_cols=['FlowName', 'Unit', 'Capacity (metric tons)',
+                    'Utilization'])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_format_scores():
+    def increment(s, position, by):
+        values = s.strip('()').split(';')
+        values[position - 1] = str(min(int(values[position - 1]) + by,
+                                       dqi.MAX_SCORE))
+        return '(' + ';'.join(values) + ')'
+
+    indicators = {i: {'score': s} for i, s in enumerate([1, 4, 5, 2, 3])}
+    flags = np.array([[a, b, c] for a in (0, 1) for b in (0, 1)
+                      for c in (0, 1)], dtype=bool)
+    scores = dqi.score_array(indicators, len(flags))
+    dqi.increment(scores, flags[:, 0], 1)
+    dqi.increment(scores, flags[:, 1], 2, by=2)
+    scores[flags[:, 2]] = 0
+    expected = []
+    for a, b, c in flags:
+        s = '(1;4;5;2;3)'
+        s = increment(s, 1, 1) if a else s
+        s = increment(s, 2, 2) if b else s
+        expected.append('' if c else s)
+    assert list(dqi.format_scores(scores)) == expected
+
+
+def test_uuids():
+    make_uuid = pytest.importorskip('esupy.util').make_uuid
+    names = pd.Series(['Carbon dioxide', 'Methane', None, 'Carbon dioxide'])
+    contexts = pd.Series(['emission/air', 'emission/air', 'emission/air',
+                          'emission/water'])
+    assert list(uuid_cache.uuids(names.fillna(''), contexts)) == [
+        make_uuid(n, c) for n, c in zip(names.fillna(''), contexts)]
+    assert list(uuid_cache.join(contexts, names.fillna(''))) == [
+        f'{c}/{n}' for c, n in zip(contexts, names.fillna(''))]
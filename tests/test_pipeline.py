@@ -0,0 +1,131 @@
+"""
+Pipeline checks: the tensor engine against the frame calculation, and an
+offline build through json_build against the committed export.
+"""
+
+import json
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import process_marine as pm
+import tensor_engine
+from aggregation import aggregate_exchanges, round_sig_figs
+from conftest import make_pipeline
+from incremental_export import FolderWriter
+from streaming_export import TeeWriter, ZipWriter
+
+export_path = Path(pm.parent_path) / 'output' / 'marine_v1.0'
+
+NUMERIC = ['AvgOfDistance (nm)', 'Capacity (metric tons)', 'Utilization',
+           'Energy', 'FlowTotal', 'tons']
+
+
+def _sorted(df):
+    df = df.astype({c: float for c in NUMERIC})
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def _content(obj):
+    """Object dict without the time it was created."""
+    d = obj if isinstance(obj, dict) else json.loads(obj)
+    return {k: v for k, v in d.items() if k != 'lastChange'}
+
+
+def _exported_ids(folder):
+    return {f.stem for f in (export_path / folder).glob('*.json')}
+
+
+@pytest.fixture(scope='module')
+def build(pipeline):
+    pytest.importorskip('flcac_utils')
+    pytest.importorskip('esupy')
+    return pipeline.get('json_build')
+
+
+def test_tensor_matches_frame(pipeline):
+    speeds = pipeline.get('engine_power')
+    frame = pipeline.get('emissions')
+    tensor = tensor_engine.emissions_by_leg(
+        pm.run_timing(speeds, pm.data_path), speeds,
+        pm.load_emission_factors(), legs=pm.legs, engines=pm.engines,
+        zones=pm.zones, drop_zeros=False)
+    assert len(tensor) == len(frame)
+    pd.testing.assert_frame_equal(_sorted(tensor[frame.columns]),
+                                  _sorted(frame), check_dtype=False,
+                                  check_exact=False, rtol=1e-12)
+
+
+def test_tensor_drops_zeros(pipeline):
+    speeds = pipeline.get('engine_power')
+    frame = pipeline.get('emissions')
+    tensor = make_pipeline(pipeline.cache_path / 'tensor', 'tensor').get(
+        'emissions')
+    nonzero = frame[frame['FlowTotal'].astype(float) != 0]
+    pd.testing.assert_frame_equal(_sorted(tensor[frame.columns]),
+                                  _sorted(nonzero), check_dtype=False,
+                                  check_exact=False, rtol=1e-12)
+
+
+def test_aggregation_matches_groupby(pipeline, build):
+    df = pipeline.get('dqi').drop(columns=['Energy', 'FlowTotal', 'tons',
+                                           'Zone', 'Leg', 'Engine', 'em_flag',
+                                           'AvgOfDistance (nm)'])
+    sum_cols = ['FlowAmount', 'amount']
+    expected = (df.groupby([c for c in df if c not in sum_cols], dropna=False)
+                .agg('sum').reset_index())
+    pd.testing.assert_frame_equal(aggregate_exchanges(df, sum_cols), expected)
+    result = pipeline.get('aggregation')
+    np.testing.assert_array_equal(
+        result['amount'], round_sig_figs(expected['amount'], 4))
+
+
+def test_json_build_matches_export(build):
+    processes = build['processes']
+    assert set(processes) == _exported_ids('processes')
+    flows = pm.referenced_flows(build['flows'],
+                                {e.flow.id for p in processes.values()
+                                 for e in p.exchanges})
+    assert set(flows) == _exported_ids('flows')
+    for pid, process in processes.items():
+        with open(export_path / 'processes' / f'{pid}.json',
+                  encoding='utf-8') as f:
+            exported = json.load(f)
+        assert process.name == exported['name']
+        assert ({(e.flow.id, e.is_input) for e in process.exchanges}
+                == {(e['flow']['@id'], e.get('isInput', False))
+                    for e in exported['exchanges']})
+
+
+def test_parallel_build_is_identical(pipeline, build):
+    processes = pm.build_json(pipeline.get('aggregation'),
+                              pipeline.get('tech_flow_mapping'), workers=2,
+                              **pipeline.stages['json_build'].constants
+                              )['processes']
+    assert list(processes) == list(build['processes'])
+    for pid, process in build['processes'].items():
+        assert _content(processes[pid].to_dict()) == _content(
+            process.to_dict())
+
+
+def test_stream_matches_incremental(pipeline, build, tmp_path):
+    pm.write_json(build, tmp_path / 'incremental', incremental=True)
+    with FolderWriter(tmp_path / 'stream') as folder, \
+            ZipWriter(tmp_path / 'stream.zip') as zw:
+        pm.stream_json(pipeline.get('aggregation'),
+                       pipeline.get('tech_flow_mapping'),
+                       TeeWriter(zw, folder),
+                       **pipeline.stages['json_build'].constants)
+
+    def files(path):
+        return {str(f.relative_to(path)): _content(f.read_bytes())
+                for f in path.rglob('*.json')}
+
+    incremental = files(tmp_path / 'incremental' / 'marine_v1.0')
+    assert files(tmp_path / 'stream') == incremental
+    with zipfile.ZipFile(tmp_path / 'stream.zip') as z:
+        assert {n: _content(z.read(n)) for n in z.namelist()
+                if n in incremental} == incremental
@@ -0,0 +1,107 @@
+"""
+UUIDs and other row keys computed once per unique combination of values and
+mapped back to the rows by their factorized codes. UUIDs are generated with
+esupy.util.make_uuid and kept in a cache that persists across runs in
+.cache/uuids, invalidated when the esupy version changes.
+"""
+
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+cache_path = Path(__file__).parent / '.cache' / 'uuids' / 'make_uuid.pkl'
+
+MAX_ENTRIES = 1_000_000 # least recently used entries are dropped beyond this
+
+_cache = None
+_version = None
+_modified = False
+
+
+def _esupy_version():
+    try:
+        from importlib.metadata import version
+        return version('esupy')
+    except Exception:
+        return None
+
+
+def _load():
+    global _cache, _version
+    if _cache is None:
+        _version = _esupy_version()
+        _cache = {}
+        try:
+            with open(cache_path, 'rb') as f:
+                stored = pickle.load(f)
+            if stored.get('version') == _version:
+                _cache = stored['uuids']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            pass
+    return _cache
+
+
+def save():
+    """Write new cache entries to disk."""
+    global _modified
+    if not _modified:
+        return
+    while len(_cache) > MAX_ENTRIES:
+        del _cache[next(iter(_cache))]
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        pickle.dump({'version': _version, 'uuids': _cache}, f)
+    tmp.replace(cache_path)
+    _modified = False
+
+
+def clear():
+    global _cache, _modified
+    _cache, _modified = None, False
+    cache_path.unlink(missing_ok=True)
+
+
+def _unique(columns):
+    """Unique combinations of the columns and the position of each row's
+    combination."""
+    df = pd.DataFrame({i: pd.Series(c).reset_index(drop=True)
+                       for i, c in enumerate(columns)})
+    inverse = np.zeros(len(df), dtype=np.int64)
+    for c in df:
+        col, uniques = pd.factorize(df[c], use_na_sentinel=False)
+        inverse = pd.factorize(inverse * len(uniques) + col)[0]
+    _, first = np.unique(inverse, return_index=True)
+    keys = df.iloc[first]
+    return list(keys.itertuples(index=False, name=None)), inverse
+
+
+def uuids(*columns):
+    """
+    Vectorized make_uuid(*row) over equal length columns, e.g.
+    uuids(df['FlowName'], df['Context']).
+    :return: object array of UUID strings
+    """
+    from esupy.util import make_uuid
+    global _modified
+
+    cache = _load()
+    keys, inverse = _unique(columns)
+    values = []
+    for k in keys:
+        # move the entry to the end, so the least recently used go first
+        v = cache.pop(k, None)
+        if v is None:
+            v = make_uuid(*k)
+            _modified = True
+        cache[k] = v
+        values.append(v)
+    return np.array(values, dtype=object)[inverse]
+
+
+def join(*columns, sep='/'):
+    """Vectorized sep.join(row) over equal length columns of strings."""
+    keys, inverse = _unique(columns)
+    return np.array([sep.join(k) for k in keys], dtype=object)[inverse]
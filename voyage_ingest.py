@@ -0,0 +1,279 @@
+"""
+Route distances from voyage level activity data (e.g. Entrance and Clearance
+records, or voyage tables derived from AIS). Voyage files (CSV or Parquet, or
+folders of them) are read in chunks of rows, each voyage is assigned to a
+route (US Region, Global Region, Ship Type, Subtype) and the sums of distance,
+ECA distance and maneuvering distances are accumulated by route, so that
+memory is bounded by the chunk size and the number of routes. Files are read
+in parallel with --workers.
+
+Voyages need the columns
+
+    Distance (nm), ECA Distance (nm) (or PctECA, the share of the distance in
+    an ECA), DestManeuv_Distance, OrigManeuv_Distance
+
+and the route columns. Other names are mapped with a YAML config:
+
+    columns:                # voyage column: name used here
+      dist_nm: Distance (nm)
+    lookups:                # route column assigned from a voyage column with
+      US Region:            # a two column CSV of value, route value, where
+                            # the file does not have the route column
+        column: us_port
+        file: us_port_regions.csv
+      Ship Type: {column: vessel_type, file: vessel_types.csv}
+
+The result replaces distances.csv in the pipeline (--voyages), with
+AvgOfDistance (nm) the mean distance of the voyages of each route, AvgPctECA
+the share in an ECA of the distance of the voyages with an ECA distance, and
+the maneuvering distances averaged over the voyages that have them. Routes of
+marine_runs.csv without voyages (or without ECA or maneuvering distances)
+take those values from distances.csv; routes in neither raise an error.
+
+    python voyage_ingest.py voyages/ --config voyages.yaml --workers 4
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+ROUTE = ['US Region', 'Global Region', 'Ship Type', 'Subtype']
+DISTANCE = 'Distance (nm)'
+ECA_DISTANCE = 'ECA Distance (nm)'
+# Distance of the voyages with an ECA distance, the denominator of AvgPctECA
+ECA_BASE = 'ECA Base Distance (nm)'
+MANEUV = ['DestManeuv_Distance', 'OrigManeuv_Distance']
+# Number of voyages with a maneuvering distance, the denominators of the means
+MANEUV_VOYAGES = [f'{c} Voyages' for c in MANEUV]
+# Sums accumulated by route
+SUMS = (['Voyages', DISTANCE, 'Distance2', ECA_DISTANCE, ECA_BASE]
+        + MANEUV + MANEUV_VOYAGES)
+# Columns of distances.csv
+DISTANCES = ['AvgOfDistance (nm)', 'AvgPctECA', 'DestManeuv_Distance',
+             'OrigManeuv_Distance']
+
+SUFFIXES = ('.csv', '.parquet')
+
+
+def voyage_files(paths):
+    """Voyage files of paths, with folders expanded (recursively)."""
+    files = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files += sorted(f for f in p.rglob('*') if f.suffix in SUFFIXES)
+        elif p.suffix in SUFFIXES:
+            files.append(p)
+        else:
+            raise ValueError(f'{p}: voyages must be CSV or Parquet files')
+    if not files:
+        raise ValueError('No voyage files found')
+    return files
+
+
+def input_files(paths, config=None):
+    """Voyage files, config and lookup files, the inputs of the ingestion."""
+    files = voyage_files(paths)
+    if config is not None:
+        with open(config) as f:
+            spec = yaml.safe_load(f) or {}
+        files += [Path(config)] + [Path(config).parent / l['file']
+                                   for l in spec.get('lookups', {}).values()]
+    return files
+
+
+def load_config(path=None):
+    """
+    :param path: YAML file with `columns` and `lookups`, see module docstring
+    :return: dict of columns (rename) and lookups ({route column: (voyage
+        column, dict of values)})
+    """
+    spec = {}
+    if path is not None:
+        with open(path) as f:
+            spec = yaml.safe_load(f) or {}
+    lookups = {}
+    for key, lookup in spec.get('lookups', {}).items():
+        if key not in ROUTE:
+            raise ValueError(f'Lookups assign the route columns, not {key}')
+        file = Path(path).parent / lookup['file']
+        values = pd.read_csv(file, index_col=0, dtype=str).iloc[:, 0]
+        lookups[key] = (lookup['column'], values.to_dict())
+    return {'columns': spec.get('columns', {}), 'lookups': lookups}
+
+
+def _read_columns(path, columns, lookups):
+    """Columns to read from path, by their names in the file."""
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        available = pq.read_schema(path).names
+    else:
+        available = pd.read_csv(path, nrows=0).columns.tolist()
+    names = {columns.get(c, c): c for c in available}
+    needed = ([c for c in ROUTE if c in names or c not in lookups]
+              + [DISTANCE, ECA_DISTANCE if ECA_DISTANCE in names else 'PctECA']
+              + MANEUV)
+    sources = [lookups[c][0] for c in ROUTE if c in lookups and c not in names]
+    missing = ([c for c in needed if c not in names]
+               + [c for c in sources if c not in available])
+    if missing:
+        raise ValueError(f'{path.name} is missing columns: {", ".join(missing)}')
+    return [names[c] for c in needed] + sources
+
+
+def read_chunks(path, columns=None, chunk_size=1_000_000):
+    """Yield dfs of at most chunk_size rows of a CSV or Parquet file."""
+    path = Path(path)
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size,
+                                                       columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+
+
+def chunk_sums(chunk, columns=None, lookups=None):
+    """
+    Assign the voyages of chunk to routes and sum them.
+    :return: df of SUMS indexed by ROUTE, number of voyages not assigned to a
+        route (missing route or distance)
+    """
+    chunk = chunk.rename(columns=columns or {})
+    for key, (column, values) in (lookups or {}).items():
+        if key not in chunk:
+            chunk[key] = chunk[column].map(values)
+    if ECA_DISTANCE not in chunk:
+        chunk[ECA_DISTANCE] = chunk['PctECA'] * chunk[DISTANCE]
+    assigned = chunk[ROUTE + [DISTANCE]].notna().all(axis=1)
+    # ECA and maneuvering distances are averaged over the voyages that have
+    # them, missing values do not count as zero
+    sums = (chunk[assigned]
+            .assign(Voyages = 1,
+                    Distance2 = lambda x: x[DISTANCE] ** 2,
+                    **{ECA_BASE: lambda x: x[DISTANCE].where(
+                        x[ECA_DISTANCE].notna(), 0)},
+                    **{v: lambda x, c=c: x[c].notna().astype(int)
+                       for c, v in zip(MANEUV, MANEUV_VOYAGES)})
+            .groupby(ROUTE, sort=False)[SUMS].sum()
+            )
+    return sums, int((~assigned).sum())
+
+
+def _combine(frames):
+    return pd.concat(frames).groupby(level=ROUTE, sort=True).sum()
+
+
+def file_sums(path, columns=None, lookups=None, chunk_size=1_000_000):
+    """Sums by route of the voyages of one file, number not assigned."""
+    columns, lookups = columns or {}, lookups or {}
+    usecols = _read_columns(Path(path), columns, lookups)
+    total, unassigned = pd.DataFrame(), 0
+    for chunk in read_chunks(path, usecols, chunk_size):
+        sums, n = chunk_sums(chunk, columns, lookups)
+        total = _combine([total, sums]) if len(total) else sums
+        unassigned += n
+    return total, unassigned
+
+
+def _file_sums(args):
+    return file_sums(*args)
+
+
+def ingest(paths, columns=None, lookups=None, chunk_size=1_000_000,
+           workers=1):
+    """
+    :param paths: list of voyage files or folders
+    :param workers: int, number of processes reading files, 1 to read serially
+    :return: df of SUMS by route, number of voyages not assigned to a route
+    """
+    tasks = [(f, columns, lookups, chunk_size) for f in voyage_files(paths)]
+    if workers <= 1:
+        results = [_file_sums(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_file_sums, tasks))
+    return (_combine([s for s, _ in results]),
+            sum(n for _, n in results))
+
+
+def distance_table(sums):
+    """Route distances in the columns of distances.csv, from the sums. Means
+    are NaN for routes without voyages with the value."""
+    n = sums['Voyages']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (pd.DataFrame({
+                    'AvgOfDistance (nm)': sums[DISTANCE] / n,
+                    'AvgPctECA': sums[ECA_DISTANCE] / sums[ECA_BASE],
+                    **{c: sums[c] / sums[v]
+                       for c, v in zip(MANEUV, MANEUV_VOYAGES)},
+                    })
+                .reset_index())
+
+
+def statistics(sums):
+    """Number of voyages and mean, standard deviation of distance by route."""
+    n = sums['Voyages']
+    mean = sums[DISTANCE] / n
+    var = (sums['Distance2'] - n * mean ** 2) / (n - 1)
+    return (distance_table(sums)
+            .assign(Voyages = n.to_numpy(),
+                    SdOfDistance = np.sqrt(var.clip(lower=0)).to_numpy()))
+
+
+def voyage_distances(data_path, voyages, config=None, chunk_size=1_000_000,
+                     workers=1):
+    """
+    Pipeline stage in place of distances.csv. Routes of marine_runs.csv
+    without voyages, or without voyages with an ECA or maneuvering distance,
+    take those values from distances.csv.
+    :param voyages: list of voyage files or folders
+    :param config: path to a YAML config of columns and lookups
+    :return: df of DISTANCES by ROUTE for the routes of marine_runs.csv
+    """
+    config = load_config(config)
+    sums, unassigned = ingest(voyages, config['columns'], config['lookups'],
+                              chunk_size=chunk_size, workers=workers)
+    print(f'{int(sums["Voyages"].sum())} voyages on {len(sums)} routes, '
+          f'{unassigned} not assigned to a route')
+    routes = (pd.read_csv(data_path / 'marine_runs.csv')[ROUTE]
+              .drop_duplicates().reset_index(drop=True))
+    distances = routes.merge(distance_table(sums), how='left', on=ROUTE)
+    missing = distances[DISTANCES].isna()
+    if missing.any(axis=None):
+        fallback = pd.read_csv(data_path / 'distances.csv')
+        fallback = routes.merge(fallback, how='left',
+                                on=[c for c in ROUTE if c in fallback])
+        print(f'{missing.all(axis=1).sum()} routes of marine_runs.csv have no '
+              f'voyages and {(missing.any(axis=1) & ~missing.all(axis=1)).sum()}'
+              ' lack ECA or maneuvering distances, taken from distances.csv:')
+        print(routes[missing.any(axis=1)].to_string(index=False))
+        distances[DISTANCES] = distances[DISTANCES].fillna(fallback[DISTANCES])
+    unresolved = distances[DISTANCES].isna().any(axis=1)
+    if unresolved.any():
+        raise ValueError('Routes without voyages or a row in distances.csv:\n'
+                         + routes[unresolved].to_string(index=False))
+    return distances
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('voyages', nargs='+',
+                        help='voyage CSV or Parquet files, or folders')
+    parser.add_argument('--config', help='YAML config of columns and lookups')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', default='voyage_distances.csv',
+                        help='CSV of route statistics')
+    args = parser.parse_args()
+    config = load_config(args.config)
+    sums, unassigned = ingest(args.voyages, config['columns'],
+                              config['lookups'], chunk_size=args.chunk_size,
+                              workers=args.workers)
+    statistics(sums).to_csv(args.output, index=False)
+    print(f'{int(sums["Voyages"].sum())} voyages on {len(sums)} routes, '
+          f'{unassigned} not assigned, written to {args.output}')